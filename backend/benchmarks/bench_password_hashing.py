@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark for password hashing
+Compares bcrypt called inline in the event loop with the PasswordHasher thread pool,
+reporting logins/second and the worst event-loop stall seen by a 10ms ticker.
+
+Usage: python benchmarks/bench_password_hashing.py [--logins 64] [--rounds 12] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import bcrypt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")  # client connects lazily, never used here
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from server import PasswordHasher  # noqa: E402
+
+
+async def measure(name, verify, logins):
+    """Run `logins` concurrent verifications while a ticker measures loop lag"""
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - start - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+
+    assert all(results)
+    print(f"{name:<22} {logins / elapsed:8.1f} logins/s   max loop stall {max(stalls, default=0) * 1000:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    stored = bcrypt.hashpw(password.encode(), bcrypt.gensalt(args.rounds)).decode()
+    hasher = PasswordHasher(rounds=args.rounds, max_concurrency=args.concurrency)
+
+    async def inline_verify():
+        return bcrypt.checkpw(password.encode(), stored.encode())
+
+    async def pooled_verify():
+        matches, _ = await hasher.verify(password, stored)
+        return matches
+
+    print(f"bcrypt rounds={args.rounds}, {args.logins} concurrent logins, pool size {args.concurrency}")
+    await measure("inline (blocking)", inline_verify, args.logins)
+    await measure("PasswordHasher pool", pooled_verify, args.logins)
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
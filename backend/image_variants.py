@@ -0,0 +1,58 @@
+"""Image variant rendering for the image store.
+
+Runs inside a process pool (see server.image_pool), so this module only imports Pillow.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# kind -> variant name -> (width, height); height None keeps the aspect ratio
+VARIANT_SPECS = {
+    "menu": {"thumb": (128, 128), "small": (256, 256), "medium": (512, 512)},  # 1:1 menu cards
+    "banner": {"small": (640, None), "large": (1280, None)},
+}
+
+
+def _encode(img: Image.Image) -> tuple:
+    out = BytesIO()
+    if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+        img.save(out, format="PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    img.convert("RGB").save(out, format="JPEG", quality=85, optimize=True, progressive=True)
+    return out.getvalue(), "image/jpeg"
+
+
+def render_variants(data: bytes, kind: str) -> dict:
+    """Validate an uploaded image and render its size variants.
+
+    Raises ValueError for data Pillow cannot decode.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            img.load()
+            original = {
+                "content_type": Image.MIME.get(img.format, "application/octet-stream"),
+                "width": img.width,
+                "height": img.height,
+            }
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+            variants = {}
+            for name, (width, height) in VARIANT_SPECS.get(kind, {}).items():
+                if height:
+                    variant = ImageOps.fit(img, (width, height), Image.LANCZOS)
+                else:
+                    variant = img.copy()
+                    variant.thumbnail((width, width * 10), Image.LANCZOS)
+                encoded, content_type = _encode(variant)
+                variants[name] = {
+                    "data": encoded,
+                    "content_type": content_type,
+                    "width": variant.width,
+                    "height": variant.height,
+                }
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unsupported image: {e}")
+    return {"original": original, "variants": variants}
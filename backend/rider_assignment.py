@@ -0,0 +1,107 @@
+"""Capacity-constrained rider assignment.
+
+Customers are clustered with k-means (one cluster per rider). Clusters are then
+matched to riders by how many customers each rider already serves, and customers
+are re-assigned greedily under per-meal-period capacities, recentering the
+clusters between rounds.
+"""
+import numpy as np
+
+KM_PER_DEGREE = 111.32
+
+
+def project_km(latlng: np.ndarray) -> np.ndarray:
+    """Equirectangular projection to km - accurate enough inside one city"""
+    lat0 = np.radians(latlng[:, 0].mean())
+    return np.column_stack((latlng[:, 0] * KM_PER_DEGREE, latlng[:, 1] * KM_PER_DEGREE * np.cos(lat0)))
+
+
+def _sq_distances(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 50, seed: int = 0) -> tuple:
+    """k-means++ seeding followed by Lloyd iterations; returns (centers, labels)"""
+    rng = np.random.default_rng(seed)
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.integers(len(points))]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, k):
+        total = closest.sum()
+        index = rng.choice(len(points), p=closest / total) if total > 0 else rng.integers(len(points))
+        centers[c] = points[index]
+        closest = np.minimum(closest, ((points - centers[c]) ** 2).sum(axis=1))
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = _sq_distances(points, centers).argmin(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            members = points[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+    return centers, labels
+
+
+def match_clusters_to_riders(labels: np.ndarray, current: np.ndarray, k: int) -> np.ndarray:
+    """Permutation cluster -> rider that keeps as many current assignments as possible (greedy)"""
+    overlap = np.zeros((k, k), dtype=np.int64)
+    known = current >= 0
+    np.add.at(overlap, (labels[known], current[known]), 1)
+    mapping = np.full(k, -1, dtype=np.int64)
+    free_riders = set(range(k))
+    for flat in np.argsort(-overlap, axis=None):
+        cluster, rider = divmod(int(flat), k)
+        if mapping[cluster] == -1 and rider in free_riders:
+            mapping[cluster] = rider
+            free_riders.discard(rider)
+    return mapping
+
+
+def assign_riders(latlng: np.ndarray, demands: np.ndarray, capacities: np.ndarray, current: np.ndarray,
+                  rounds: int = 10, stickiness: float = 0.2) -> tuple:
+    """Assign n customers to k riders.
+
+    latlng: (n, 2) customer locations; demands: (n, m) meals per meal period;
+    capacities: (k, m) rider capacity per meal period; current: (n,) current rider index or -1.
+    The current rider's distance is discounted by stickiness so re-balancing moves few customers.
+    Returns (assignment (n,), overflow (n,) bool - customers placed over capacity).
+    """
+    n, k = len(latlng), len(capacities)
+    if n == 0 or k == 0:
+        return np.full(n, -1, dtype=np.int64), np.zeros(n, dtype=bool)
+    points = project_km(latlng)
+    centers, labels = kmeans(points, min(k, n))
+    if len(centers) < k:  # fewer customers than riders
+        centers = np.vstack([centers, np.repeat(centers[:1], k - len(centers), axis=0)])
+    centers = centers[np.argsort(match_clusters_to_riders(labels, current, k))]
+
+    assignment = np.full(n, -1, dtype=np.int64)
+    overflow = np.zeros(n, dtype=bool)
+    for _ in range(rounds):
+        cost = np.sqrt(_sq_distances(points, centers))
+        known = np.flatnonzero(current >= 0)
+        cost[known, current[known]] *= 1 - stickiness
+        preference = np.argsort(cost, axis=1)
+        # Customers with the most to lose from their second choice pick first
+        sorted_cost = np.take_along_axis(cost, preference, axis=1)
+        regret = sorted_cost[:, 1] - sorted_cost[:, 0] if k > 1 else np.zeros(n)
+        remaining = capacities.astype(float).copy()
+        new_assignment = np.empty(n, dtype=np.int64)
+        overflow[:] = False
+        for i in np.argsort(-regret):
+            fits = (remaining[preference[i]] >= demands[i]).all(axis=1)
+            choice = preference[i][fits.argmax()] if fits.any() else preference[i][0]
+            overflow[i] = not fits.any()
+            new_assignment[i] = choice
+            remaining[choice] -= demands[i]
+        if np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        for r in range(k):
+            members = points[assignment == r]
+            if len(members):
+                centers[r] = members.mean(axis=0)
+    return assignment, overflow
@@ -0,0 +1,82 @@
+"""Rider route ordering.
+
+Nearest-neighbour construction followed by 2-opt over a haversine distance matrix.
+Routes are open paths: they start at the origin (the kitchen) and end at the last stop.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088  # mean radius; shared by every distance in the backend
+
+
+def haversine_matrix(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances in km"""
+    lat = np.radians(lats)
+    lng = np.radians(lngs)
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def nearest_neighbour(dist: np.ndarray, start: int = 0) -> np.ndarray:
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for k in range(n):
+        order[k] = current
+        visited[current] = True
+        if k == n - 1:
+            break
+        candidates = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(candidates))
+    return order
+
+
+def two_opt(route: np.ndarray, dist: np.ndarray, max_passes: int = 50) -> np.ndarray:
+    """Improve a path with fixed endpoints by reversing segments while that shortens it.
+
+    For each segment start the gains of every segment end are evaluated at once.
+    """
+    route = route.copy()
+    n = len(route)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 2):
+            a, b = route[i - 1], route[i]
+            js = np.arange(i + 1, n - 1)
+            c, e = route[js], route[js + 1]
+            delta = dist[a, c] + dist[b, e] - dist[a, b] - dist[c, e]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                j = js[k]
+                route[i:j + 1] = route[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route
+
+
+def plan_route(origin, points) -> tuple:
+    """Order points [(lat, lng), ...] starting from origin (lat, lng) or None.
+
+    Returns (order as indexes into points, leg distances in km).
+    """
+    if not points:
+        return [], []
+    coords = ([origin] if origin else []) + list(points)
+    matrix = haversine_matrix(np.array([c[0] for c in coords], dtype=float), np.array([c[1] for c in coords], dtype=float))
+    # A zero-cost dummy node as the free end point turns the open path into a fixed-endpoint 2-opt
+    n = len(coords)
+    dist = np.zeros((n + 1, n + 1))
+    dist[:n, :n] = matrix
+
+    # Without an origin, start from an edge of the cluster rather than an arbitrary stop
+    start = 0 if origin else int(np.argmax(matrix.sum(axis=1)))
+    route = nearest_neighbour(matrix, start)
+    route = two_opt(np.append(route, n), dist)[:-1]
+
+    legs = [float(matrix[route[k - 1], route[k]]) for k in range(1, len(route))]
+    if origin:
+        return [int(idx) - 1 for idx in route[1:]], legs
+    return [int(idx) for idx in route], [0.0] + legs
@@ -1,8 +1,11 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ASCENDING, DESCENDING, GEOSPHERE, UpdateOne, UpdateMany, ReturnDocument
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
@@ -10,8 +13,28 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta, time
+import asyncio
+import base64
+import binascii
+import csv
 import hashlib
-import razorpay
+import hmac
+import multiprocessing
+import json
+import math
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from starlette.concurrency import run_in_threadpool
+from time import monotonic
+import bcrypt
+import httpx
+import numpy as np
+from image_variants import render_variants
+from route_planner import EARTH_RADIUS_KM, plan_route
+from rider_assignment import assign_riders
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -21,12 +44,10 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Razorpay client (optional - only if keys provided)
-razorpay_client = None
+# Payment gateway (optional - razorpay when keys provided, or the in-process stub)
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET')
-if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
-    razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'razorpay' if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET else 'none')
 
 app = FastAPI(title="FoodFleet API", version="2.0.0")
 api_router = APIRouter(prefix="/api")
@@ -192,6 +213,7 @@ class SubscriptionBase(BaseModel):
     subscription_id: str = Field(default_factory=lambda: f"sub_{uuid.uuid4().hex[:12]}")
     user_id: str
     kitchen_id: str
+    city: Optional[str] = None  # Denormalized from the customer for reporting
     plan_id: str
     plan_type: str
     diet_type: str
@@ -207,6 +229,7 @@ class SubscriptionBase(BaseModel):
     next_renewal_amount: float = 0
     assigned_delivery_boy_id: Optional[str] = None  # Assigned delivery boy for this customer
     status: str = "active"  # active, paused, expired, cancelled
+    schedule_status: str = "materialized"  # pending (deferred generation), materialized
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_by: Optional[str] = None
 
@@ -220,6 +243,7 @@ class DeliveryBase(BaseModel):
     delivery_date: str  # YYYY-MM-DD
     delivery_day_number: int  # Menu sequence day (1-24)
     meal_period: str  # breakfast, lunch, dinner
+    diet_type: Optional[str] = None  # Denormalized from the subscription for production sheets
     menu_items: List[Dict[str, Any]] = []
     status: str = "scheduled"  # scheduled, preparing, ready, out_for_delivery, delivered, cancelled, skipped
     address: str
@@ -303,14 +327,475 @@ class ShopItemBase(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ==================== DATABASE INDEXES ====================
+
+# Declarative index registry - reconciled on startup (missing indexes are created,
+# unknown ones are only reported, never dropped)
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("phone", ASCENDING)], name="phone_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email"),
+        IndexModel([("role", ASCENDING), ("city", ASCENDING), ("kitchen_id", ASCENDING)], name="role_city_kitchen"),
+        IndexModel([("geo", GEOSPHERE)], name="geo_2dsphere"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "kitchens": [
+        IndexModel([("kitchen_id", ASCENDING)], name="kitchen_id_unique", unique=True),
+        IndexModel([("geo", GEOSPHERE)], name="geo_2dsphere"),
+    ],
+    "plans": [
+        IndexModel([("plan_id", ASCENDING)], name="plan_id_unique", unique=True),
+        IndexModel([("selected_items", ASCENDING)], name="selected_items"),
+    ],
+    "menu_items": [
+        IndexModel([("item_id", ASCENDING)], name="item_id_unique", unique=True),
+    ],
+    "menu_templates": [
+        IndexModel([("template_id", ASCENDING)], name="template_id_unique", unique=True),
+        IndexModel([("plan_type", ASCENDING), ("diet_type", ASCENDING)], name="plan_type_diet_type"),
+    ],
+    "subscriptions": [
+        IndexModel([("subscription_id", ASCENDING)], name="subscription_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("remaining_deliveries", ASCENDING)], name="status_remaining"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("kitchen_id", ASCENDING), ("status", ASCENDING)], name="kitchen_status"),
+        IndexModel([("schedule_status", ASCENDING)], name="schedule_status"),
+        IndexModel([("city", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)], name="city_status_created_at"),
+        IndexModel([("created_at", DESCENDING), ("subscription_id", DESCENDING)], name="created_at_subscription_id"),
+    ],
+    "deliveries": [
+        IndexModel([("delivery_id", ASCENDING)], name="delivery_id_unique", unique=True),
+        IndexModel([("kitchen_id", ASCENDING), ("delivery_date", ASCENDING), ("meal_period", ASCENDING)], name="kitchen_date_meal"),
+        IndexModel([("delivery_boy_id", ASCENDING), ("delivery_date", ASCENDING), ("meal_period", ASCENDING)], name="delivery_boy_date_meal"),
+        IndexModel([("subscription_id", ASCENDING), ("delivery_date", ASCENDING)], name="subscription_date"),
+        IndexModel([("user_id", ASCENDING), ("delivery_date", ASCENDING)], name="user_date"),
+        IndexModel([("delivery_date", ASCENDING), ("status", ASCENDING)], name="date_status"),
+        IndexModel([("delivery_date", ASCENDING), ("delivery_id", ASCENDING)], name="date_delivery_id"),
+        IndexModel([("geo", GEOSPHERE)], name="geo_2dsphere"),
+    ],
+    "delivery_requests": [
+        IndexModel([("request_id", ASCENDING)], name="request_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("request_id", DESCENDING)], name="status_created_at_request_id"),
+        IndexModel([("created_at", DESCENDING), ("request_id", DESCENDING)], name="created_at_request_id"),
+    ],
+    "notifications": [
+        IndexModel([("notification_id", ASCENDING)], name="notification_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("target_roles", ASCENDING), ("created_at", DESCENDING)], name="target_roles_created_at"),
+    ],
+    "notification_reads": [
+        IndexModel([("user_id", ASCENDING), ("notification_id", ASCENDING)], name="user_notification_unique", unique=True),
+    ],
+    "audit_logs": [
+        IndexModel([("timestamp", DESCENDING), ("log_id", DESCENDING)], name="timestamp_log_id"),
+        IndexModel([("entity_type", ASCENDING), ("timestamp", DESCENDING), ("log_id", DESCENDING)], name="entity_type_timestamp_log_id"),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("log_id", DESCENDING)], name="user_timestamp_log_id"),
+    ],
+    "payment_orders": [
+        IndexModel([("order_id", ASCENDING)], name="order_id_unique", unique=True),
+        IndexModel([("idempotency_key", ASCENDING), ("status", ASCENDING)], name="idempotency_key_status"),
+    ],
+    "revenue_daily": [
+        IndexModel([("date", ASCENDING), ("city", ASCENDING), ("kitchen_id", ASCENDING)], name="date_city_kitchen"),
+    ],
+    "images": [
+        IndexModel([("image_id", ASCENDING)], name="image_id_unique", unique=True),
+        IndexModel([("sha256", ASCENDING), ("kind", ASCENDING)], name="sha256_kind"),
+    ],
+    "cache_invalidations": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+}
+
+# Representative hot-path queries, explained by the index report to prove they are index-backed
+HOT_QUERIES = [
+    {"collection": "users", "filter": {"user_id": "user_x"}},
+    {"collection": "users", "filter": {"phone": "0000000000"}},
+    {"collection": "user_sessions", "filter": {"session_token": "sess_x"}},
+    {"collection": "deliveries", "filter": {"kitchen_id": "kitchen_x", "delivery_date": "2026-01-01"}},
+    {"collection": "deliveries", "filter": {"kitchen_id": "kitchen_x", "delivery_date": "2026-01-01", "meal_period": "lunch"}},
+    {"collection": "deliveries", "filter": {"delivery_boy_id": "user_x", "delivery_date": "2026-01-01"}},
+    {"collection": "deliveries", "filter": {"subscription_id": "sub_x", "status": "scheduled"}},
+    {"collection": "subscriptions", "filter": {"status": "active", "remaining_deliveries": {"$lte": 3}}},
+    {"collection": "notifications", "filter": {"$or": [{"user_id": "user_x"}, {"target_roles": "admin"}]}, "sort": {"created_at": -1}},
+    {"collection": "audit_logs", "filter": {}, "sort": {"timestamp": -1}, "limit": 100},
+]
+
+def _index_key(spec: dict) -> list:
+    return [tuple(k) for k in spec["key"].items()]
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """Create every registry index that is missing; returns created names per collection"""
+    created = {}
+    for collection, models in INDEX_REGISTRY.items():
+        existing = await db[collection].index_information()
+        for model in models:
+            name = model.document["name"]
+            if name in existing:
+                if [tuple(k) for k in existing[name]["key"]] != _index_key(model.document):
+                    logger.warning("Index %s.%s differs from the registry definition", collection, name)
+                continue
+            try:
+                await db[collection].create_indexes([model])
+                created.setdefault(collection, []).append(name)
+            except OperationFailure as e:
+                # e.g. duplicate keys for a unique index - keep serving, surface in the report
+                logger.error("Could not create index %s.%s: %s", collection, name, e)
+    return created
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += _plan_stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+async def explain_hot_queries() -> List[dict]:
+    """Explain each hot query and report the winning plan's stages"""
+    results = []
+    for q in HOT_QUERIES:
+        cmd = {"find": q["collection"], "filter": q["filter"]}
+        if "sort" in q:
+            cmd["sort"] = q["sort"]
+        if "limit" in q:
+            cmd["limit"] = q["limit"]
+        explain = await db.command({"explain": cmd, "verbosity": "queryPlanner"})
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        results.append({
+            "collection": q["collection"],
+            "filter": q["filter"],
+            "sort": q.get("sort"),
+            "stages": stages,
+            "uses_index": "COLLSCAN" not in stages
+        })
+    return results
+
+async def index_report() -> Dict[str, Any]:
+    """Report missing, unregistered and unused indexes per collection"""
+    report = {}
+    for collection, models in INDEX_REGISTRY.items():
+        existing = await db[collection].index_information()
+        registered = {m.document["name"] for m in models}
+        
+        usage = {}
+        try:
+            async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = stat["accesses"]["ops"]
+        except OperationFailure:
+            pass
+        
+        report[collection] = {
+            "missing": sorted(registered - set(existing)),
+            "unregistered": sorted(set(existing) - registered - {"_id_"}),
+            "unused": sorted(name for name, ops in usage.items() if ops == 0 and name != "_id_"),
+            "usage": usage
+        }
+    return report
+
+# ==================== EVENT HUB ====================
+
+EVENT_HISTORY_SIZE = int(os.environ.get("EVENT_HISTORY_SIZE", "5000"))
+EVENT_SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("EVENT_SUBSCRIBER_QUEUE_SIZE", "200"))
+EVENT_HEARTBEAT_INTERVAL = float(os.environ.get("EVENT_HEARTBEAT_INTERVAL", "15"))
+
+class EventSubscriber(asyncio.Queue):
+    """A subscriber's event queue; overflowed is set once an event could not be queued"""
+    
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.overflowed = False
+
+class EventHub:
+    """In-process pub/sub for live events, with a bounded replay history.
+
+    Events are published to topics such as "user:<id>", "kitchen:<id>", "rider:<id>"
+    and "role:<role>". Event ids are "<epoch>-<seq>" so a client resuming with a
+    Last-Event-ID from a previous process replays nothing stale.
+    """
+    
+    def __init__(self, history_size: int, queue_size: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._seq = 0
+        self._history: deque = deque(maxlen=history_size)  # (seq, topics, event)
+        self._subscribers: Dict[str, set] = {}
+        self.published = 0
+        self.overflows = 0
+    
+    def publish(self, topics: List[str], event_type: str, data: dict):
+        self._seq += 1
+        topics = [t for t in topics if t]
+        event = {"id": f"{self.epoch}-{self._seq}", "seq": self._seq, "type": event_type, "data": data}
+        self._history.append((self._seq, set(topics), event))
+        self.published += 1
+        delivered = set()
+        for topic in topics:
+            for queue in self._subscribers.get(topic, ()):
+                if queue in delivered:
+                    continue
+                delivered.add(queue)
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Slow consumer - end its stream, the client resumes via Last-Event-ID
+                    self.overflows += 1
+                    queue.overflowed = True
+    
+    def subscribe(self, topics: List[str]) -> EventSubscriber:
+        queue = EventSubscriber(self.queue_size)
+        for topic in topics:
+            self._subscribers.setdefault(topic, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: EventSubscriber, topics: List[str]):
+        for topic in topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[topic]
+    
+    def replay(self, topics: List[str], last_event_id: Optional[str]) -> List[dict]:
+        """Events after last_event_id for these topics (empty if the id is from another process)"""
+        if not last_event_id or "-" not in last_event_id:
+            return []
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return []
+        wanted = set(topics)
+        return [event for event_seq, event_topics, event in self._history if event_seq > int(seq) and event_topics & wanted]
+    
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "topics": len(self._subscribers),
+            "history": len(self._history),
+            "overflows": self.overflows
+        }
+
+event_hub = EventHub(EVENT_HISTORY_SIZE, EVENT_SUBSCRIBER_QUEUE_SIZE)
+
+def publish_delivery_event(delivery: dict, status: str):
+    """Push a delivery status change to the customer, kitchen and rider streams"""
+    event_hub.publish(
+        [f"user:{delivery.get('user_id')}", f"kitchen:{delivery.get('kitchen_id')}",
+         f"rider:{delivery['delivery_boy_id']}" if delivery.get("delivery_boy_id") else None],
+        "delivery.status",
+        {
+            "delivery_id": delivery["delivery_id"],
+            "subscription_id": delivery.get("subscription_id"),
+            "delivery_date": delivery.get("delivery_date"),
+            "meal_period": delivery.get("meal_period"),
+            "status": status
+        }
+    )
+
+# ==================== WRITE-BEHIND QUEUES ====================
+
+class WriteBehindQueue:
+    """Bounded queue of documents flushed to a collection in insert_many batches.
+
+    A batch is written when it reaches batch_size or flush_interval seconds after its
+    first document. A full queue applies backpressure to producers for up to
+    put_timeout seconds, after which the document is dropped and counted.
+    """
+    
+    def __init__(self, collection: str, max_size: int, batch_size: int, flush_interval: float, put_timeout: float):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+    
+    async def put(self, doc: dict) -> bool:
+        try:
+            self._queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(doc), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.enqueued += 1
+        return True
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self, timeout: float = 10):
+        """Drain queued documents, then stop the flusher"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("%s write-behind queue not drained, %d documents lost", self.collection, self._queue.qsize())
+        self._task.cancel()
+        self._task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _flush(self, batch: List[dict]) -> bool:
+        try:
+            await db[self.collection].insert_many(batch, ordered=False)
+            self.written += len(batch)
+            self.batches += 1
+            return True
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d %s documents", len(batch), self.collection)
+            return False
+    
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+audit_log_writer = WriteBehindQueue(
+    "audit_logs",
+    max_size=int(os.environ.get("AUDIT_QUEUE_SIZE", "10000")),
+    batch_size=int(os.environ.get("AUDIT_BATCH_SIZE", "500")),
+    flush_interval=float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5")),
+    put_timeout=float(os.environ.get("AUDIT_PUT_TIMEOUT", "0.05"))
+)
+
+def broadcast_key(notification: dict) -> str:
+    """Sortable (created_at, notification_id) key used for broadcast read watermarks"""
+    return f"{notification['created_at']} {notification['notification_id']}"
+
+class NotificationQueue(WriteBehindQueue):
+    """Write-behind notifications that also maintain the unread counters.
+
+    notification_counters holds one document per user ({_id: user_id, unread}) for
+    direct notifications and one per role ({_id: "role:<role>", total, latest}) for
+    broadcasts, where latest is the broadcast_key of the newest broadcast counted in total.
+    """
+    
+    async def _flush(self, batch: List[dict]) -> bool:
+        if not await super()._flush(batch):
+            return False
+        user_incs: Dict[str, int] = {}
+        role_incs: Dict[str, int] = {}
+        role_latest: Dict[str, str] = {}
+        for doc in batch:
+            if doc.get("user_id"):
+                user_incs[doc["user_id"]] = user_incs.get(doc["user_id"], 0) + 1
+            for role in doc.get("target_roles") or []:
+                role_incs[role] = role_incs.get(role, 0) + 1
+                role_latest[role] = max(role_latest.get(role, ""), broadcast_key(doc))
+        ops = [UpdateOne({"_id": uid}, {"$inc": {"unread": n}}, upsert=True) for uid, n in user_incs.items()]
+        ops += [
+            UpdateOne({"_id": f"role:{role}"}, {"$inc": {"total": n}, "$max": {"latest": role_latest[role]}}, upsert=True)
+            for role, n in role_incs.items()
+        ]
+        if ops:
+            try:
+                await db.notification_counters.bulk_write(ops, ordered=False)
+            except Exception:
+                logger.exception("Failed to update notification counters")
+        
+        for doc in batch:
+            topics = [f"user:{doc['user_id']}"] if doc.get("user_id") else [f"role:{r}" for r in doc.get("target_roles") or []]
+            event_hub.publish(topics, "notification", {k: v for k, v in doc.items() if k != "_id"})
+        return True
+
+notification_writer = NotificationQueue(
+    "notifications",
+    max_size=int(os.environ.get("NOTIFICATION_QUEUE_SIZE", "10000")),
+    batch_size=int(os.environ.get("NOTIFICATION_BATCH_SIZE", "500")),
+    flush_interval=float(os.environ.get("NOTIFICATION_FLUSH_INTERVAL", "0.25")),
+    put_timeout=float(os.environ.get("NOTIFICATION_PUT_TIMEOUT", "0.5"))
+)
+
 # ==================== HELPER FUNCTIONS ====================
 
 def generate_password():
     """Generate a random password"""
     return uuid.uuid4().hex[:8]
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+class PasswordHasher:
+    """bcrypt hashing on a bounded thread pool so the KDF never blocks the event loop.
+
+    Legacy unsalted SHA-256 hashes still verify and are reported as needing a rehash.
+    """
+    
+    def __init__(self, rounds: int, max_concurrency: int):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="password-hash")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _run(self, fn, *args):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    
+    @staticmethod
+    def is_legacy(stored: str) -> bool:
+        return len(stored) == 64 and not stored.startswith("$2")
+    
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds))
+        return hashed.decode()
+    
+    async def verify(self, password: str, stored: Optional[str]) -> tuple:
+        """Return (matches, needs_rehash)"""
+        if not stored:
+            return False, False
+        if self.is_legacy(stored):
+            matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+            return matches, matches
+        try:
+            matches = await self._run(bcrypt.checkpw, password.encode(), stored.encode())
+        except ValueError:
+            return False, False
+        return matches, matches and int(stored.split("$")[2]) < self.rounds
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get("PASSWORD_HASH_ROUNDS", "12")),
+    max_concurrency=int(os.environ.get("PASSWORD_HASH_CONCURRENCY", "4"))
+)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
 def calculate_profile_points(user: dict) -> int:
     """Calculate profile completion points (max 100)"""
@@ -328,22 +813,21 @@ def calculate_profile_points(user: dict) -> int:
     return min(points, 100)
 
 async def log_action(user_id: str, user_role: str, action: str, entity_type: str, entity_id: str, details: dict = None, request: Request = None):
-    """Log an action to audit logs"""
-    log = AuditLog(
-        user_id=user_id,
-        user_role=user_role,
-        action=action,
-        entity_type=entity_type,
-        entity_id=entity_id,
-        details=details or {},
-        ip_address=request.client.host if request else None
-    )
-    doc = log.model_dump()
-    doc["timestamp"] = doc["timestamp"].isoformat()
-    await db.audit_logs.insert_one(doc)
+    """Log an action to audit logs (written behind by audit_log_writer, see AuditLog)"""
+    await audit_log_writer.put({
+        "log_id": f"log_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "user_role": user_role,
+        "action": action,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "details": details or {},
+        "ip_address": request.client.host if request and request.client else None,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
 
 async def send_notification(user_id: str, title: str, message: str, notif_type: str, delivery_id: str = None):
-    """Send in-app notification"""
+    """Send in-app notification (batched by notification_writer)"""
     notif = NotificationBase(
         user_id=user_id,
         title=title,
@@ -353,7 +837,104 @@ async def send_notification(user_id: str, title: str, message: str, notif_type:
     )
     doc = notif.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
-    await db.notifications.insert_one(doc)
+    await notification_writer.put(doc)
+
+async def notify_roles(target_roles: List[str], title: str, message: str, notif_type: str, **extra):
+    """Broadcast an in-app notification to every user holding one of target_roles"""
+    await notification_writer.put({
+        "notification_id": f"notif_{uuid.uuid4().hex[:12]}",
+        "user_id": None,
+        "target_roles": target_roles,
+        "title": title,
+        "message": message,
+        "type": notif_type,
+        **extra,
+        "is_read": False,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+
+def parse_date(value: str, field: str = "date") -> datetime:
+    """Parse a YYYY-MM-DD (or ISO) query parameter as a UTC datetime"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}, expected YYYY-MM-DD")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def encode_cursor(values: list) -> str:
+    """Opaque keyset pagination token"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, length: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+CUSTOMER_SUMMARY_FIELDS = ["name", "phone", "alternate_phone", "address", "allergies"]
+
+# {lat, lng} dicts stay the API format; a sibling "geo" GeoJSON point backs the 2dsphere indexes
+
+def geo_point(location: Optional[dict]) -> Optional[dict]:
+    """GeoJSON point for a {lat, lng} dict, or None when missing, invalid or the 0,0 placeholder"""
+    try:
+        lat, lng = float(location["lat"]), float(location["lng"])
+    except (TypeError, KeyError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+async def load_users_by_ids(user_ids, fields: List[str]) -> Dict[str, dict]:
+    """Batch-load users with a single $in query, keyed by user_id"""
+    ids = list({uid for uid in user_ids if uid})
+    if not ids:
+        return {}
+    projection = {"_id": 0, "user_id": 1, **{f: 1 for f in fields}}
+    users = await db.users.find({"user_id": {"$in": ids}}, projection).to_list(len(ids))
+    return {u["user_id"]: u for u in users}
+
+async def load_menu_items_by_ids(item_ids) -> Dict[str, dict]:
+    """Batch-load menu items with a single $in query, keyed by item_id"""
+    ids = list({iid for iid in item_ids if iid})
+    if not ids:
+        return {}
+    items = await db.menu_items.find({"item_id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))
+    return {item["item_id"]: item for item in items}
+
+async def validate_menu_item_ids(item_ids: List[str]):
+    """Raise 400 naming any item_id that has no menu item"""
+    ids = set(item_ids)
+    if not ids:
+        return
+    found = await db.menu_items.distinct("item_id", {"item_id": {"$in": list(ids)}})
+    missing = sorted(ids - set(found))
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Menu item(s) not found: {', '.join(missing)}")
+
+def hydrate_plan_items(selected_items: List[str], items_by_id: Dict[str, dict]) -> List[dict]:
+    """Menu item details in selected_items order, keeping duplicates and skipping unknown ids"""
+    return [items_by_id[item_id] for item_id in selected_items if item_id in items_by_id]
+
+def customer_summary(user: Optional[dict]) -> Optional[dict]:
+    """Compact customer block embedded in delivery responses"""
+    if not user:
+        return None
+    return {
+        "name": user.get("name"),
+        "phone": user.get("phone"),
+        "alternate_phone": user.get("alternate_phone"),
+        "address": user.get("address"),
+        "allergies": user.get("allergies", [])
+    }
 
 def can_cancel_delivery(meal_period: str) -> bool:
     """Check if delivery can be cancelled based on cutoff time"""
@@ -363,6 +944,269 @@ def can_cancel_delivery(meal_period: str) -> bool:
         return now < cutoff
     return False
 
+# ==================== SESSION CACHE ====================
+
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "60"))  # seconds
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+# Cross-worker invalidation: none, change_stream (falls back to poll) or poll
+SESSION_CACHE_SYNC = os.environ.get("SESSION_CACHE_SYNC", "none")
+SESSION_CACHE_POLL_INTERVAL = float(os.environ.get("SESSION_CACHE_POLL_INTERVAL", "2"))
+WORKER_ID = f"worker_{uuid.uuid4().hex[:8]}"
+
+class SessionCache:
+    """TTL- and size-bounded LRU of session_token -> resolved user"""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (user, session_expires_at, cached_until)
+        self._tokens_by_user: Dict[str, set] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def get(self, token: str) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at, cached_until = entry
+        if cached_until < monotonic() or expires_at < datetime.now(timezone.utc):
+            self._drop(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return dict(user)  # handlers mutate the returned dict
+    
+    def put(self, token: str, user: dict, expires_at: datetime):
+        if self.max_size <= 0:
+            return
+        self._drop(token)
+        self._entries[token] = (dict(user), expires_at, monotonic() + self.ttl)
+        self._tokens_by_user.setdefault(user["user_id"], set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+    
+    def invalidate_token(self, token: str):
+        if token in self._entries:
+            self._drop(token)
+            self.invalidations += 1
+    
+    def invalidate_user(self, user_id: str):
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._drop(token)
+            self.invalidations += 1
+    
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[0]["user_id"]
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+    
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "sync": SESSION_CACHE_SYNC
+        }
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+def _apply_invalidation(event: dict):
+    if event.get("session_token"):
+        session_cache.invalidate_token(event["session_token"])
+    if event.get("user_id"):
+        session_cache.invalidate_user(event["user_id"])
+
+async def invalidate_sessions(user_id: str = None, session_token: str = None):
+    """Drop cached principals locally and broadcast to other workers"""
+    event = {"user_id": user_id, "session_token": session_token}
+    _apply_invalidation(event)
+    if SESSION_CACHE_SYNC != "none":
+        await db.cache_invalidations.insert_one({**event, "origin": WORKER_ID, "created_at": datetime.now(timezone.utc)})
+
+async def _poll_session_invalidations():
+    last_seen = datetime.now(timezone.utc)
+    while True:
+        await asyncio.sleep(SESSION_CACHE_POLL_INTERVAL)
+        events = db.cache_invalidations.find({"created_at": {"$gt": last_seen}}, {"_id": 0}).sort("created_at", 1)
+        async for event in events:
+            created_at = event["created_at"]
+            last_seen = created_at if created_at.tzinfo else created_at.replace(tzinfo=timezone.utc)
+            if event.get("origin") != WORKER_ID:
+                _apply_invalidation(event)
+
+async def session_invalidation_listener():
+    """Apply invalidations published by other workers (change stream or polling)"""
+    if SESSION_CACHE_SYNC == "change_stream":
+        try:
+            async with db.cache_invalidations.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                async for change in stream:
+                    event = change["fullDocument"]
+                    if event.get("origin") != WORKER_ID:
+                        _apply_invalidation(event)
+        except OperationFailure:
+            # Change streams need a replica set - a standalone mongod falls back to polling
+            logger.warning("Change streams unavailable, polling cache_invalidations instead")
+    await _poll_session_invalidations()
+
+# ==================== CATALOG CACHE ====================
+
+# Seconds between polls of cache_versions for invalidations made by other workers (0 disables)
+CATALOG_CACHE_SYNC_INTERVAL = float(os.environ.get("CATALOG_CACHE_SYNC_INTERVAL", "5"))
+CATALOG_CACHE_MAX_KEYS = 256  # per namespace
+
+class CatalogCache:
+    """Versioned cache of pre-serialized public catalog responses.
+
+    Each namespace (plans, menu_items, ...) has a version that write handlers bump;
+    entries built for an older version are rebuilt on next read. Versions are shared
+    across workers through cache_versions documents.
+    """
+    
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._entries: Dict[str, Dict[Any, tuple]] = {}  # namespace -> key -> (version, body, etag)
+        self.hits = 0
+        self.misses = 0
+    
+    async def get(self, namespace: str, key: Any, loader) -> tuple:
+        """Return (body bytes, weak etag), loading and serializing on a miss"""
+        version = self._versions.get(namespace, 0)
+        entries = self._entries.setdefault(namespace, {})
+        entry = entries.get(key)
+        if entry and entry[0] == version:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        body = json.dumps(jsonable_encoder(await loader()), separators=(",", ":")).encode()
+        etag = f'W/"{hashlib.sha1(body).hexdigest()[:16]}"'
+        if len(entries) >= CATALOG_CACHE_MAX_KEYS:
+            entries.clear()
+        entries[key] = (version, body, etag)
+        return body, etag
+    
+    async def invalidate(self, *namespaces: str):
+        for namespace in namespaces:
+            if CATALOG_CACHE_SYNC_INTERVAL > 0:
+                doc = await db.cache_versions.find_one_and_update(
+                    {"_id": namespace}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                self._versions[namespace] = max(doc["version"], self._versions.get(namespace, 0) + 1)
+            else:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self._entries.pop(namespace, None)
+    
+    async def sync(self):
+        async for doc in db.cache_versions.find({}):
+            if doc["version"] != self._versions.get(doc["_id"]):
+                self._versions[doc["_id"]] = doc["version"]
+    
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "namespaces": {ns: {"version": self._versions.get(ns, 0), "entries": len(e)} for ns, e in self._entries.items()}
+        }
+
+catalog_cache = CatalogCache()
+
+async def catalog_sync_loop():
+    while True:
+        await asyncio.sleep(CATALOG_CACHE_SYNC_INTERVAL)
+        try:
+            await catalog_cache.sync()
+        except Exception:
+            logger.exception("Catalog cache sync failed")
+
+def etag_response(request: Request, body: bytes, etag: str) -> Response:
+    """JSON response with ETag; 304 when the client already has this version"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def cached_catalog(request: Request, namespace: str, key: Any, loader) -> Response:
+    body, etag = await catalog_cache.get(namespace, key, loader)
+    return etag_response(request, body, etag)
+
+# ==================== PAGINATION ====================
+
+# List endpoints return one page as a JSON array and, when more documents exist, an opaque
+# X-Next-Cursor header to pass back as ?cursor=. With ?stream=true they instead stream every
+# remaining document as NDJSON straight from the Motor cursor.
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+def keyset_filter(sort: List[tuple], values: list) -> dict:
+    """Documents strictly after values in sort order (the last sort field must be unique)"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: v for (f, _), v in zip(sort[:i], values[:i])}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def _ndjson_batches(cursor, enrich):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            if enrich:
+                await enrich(batch)
+            yield "".join(json.dumps(d, default=_json_default) + "\n" for d in batch).encode()
+            batch = []
+    if batch:
+        if enrich:
+            await enrich(batch)
+        yield "".join(json.dumps(d, default=_json_default) + "\n" for d in batch).encode()
+
+async def paginated_find(
+    collection,
+    query: dict,
+    projection: dict,
+    sort: List[tuple],
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    stream: bool = False,
+    enrich=None,
+    max_limit: int = MAX_PAGE_SIZE
+):
+    """Keyset-paginated find; enrich(docs) may add fields to each page or streamed batch"""
+    if cursor:
+        values = decode_cursor(cursor, len(sort))
+        query = {"$and": [query, keyset_filter(sort, values)]} if query else keyset_filter(sort, values)
+    
+    if stream:
+        docs = collection.find(query, projection).sort(sort).batch_size(STREAM_BATCH_SIZE)
+        return StreamingResponse(_ndjson_batches(docs, enrich), media_type="application/x-ndjson")
+    
+    limit = max(1, min(limit, max_limit))
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([docs[-1].get(field) for field, _ in sort])
+    if enrich:
+        await enrich(docs)
+    return docs
+
 # ==================== AUTH HELPERS ====================
 
 async def get_current_user(request: Request) -> dict:
@@ -375,6 +1219,10 @@ async def get_current_user(request: Request) -> dict:
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    cached = session_cache.get(session_token)
+    if cached is not None:
+        return cached
+    
     session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
     if not session:
         raise HTTPException(status_code=401, detail="Invalid session")
@@ -391,6 +1239,7 @@ async def get_current_user(request: Request) -> dict:
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     
+    session_cache.put(session_token, user, expires_at)
     return user
 
 def require_roles(allowed_roles: List[str]):
@@ -423,7 +1272,8 @@ async def signup(user_data: UserCreate, response: Response, request: Request):
         "city": user_data.city,
         "address": user_data.address,
         "google_location": user_data.google_location,
-        "password_hash": hash_password(password),
+        "geo": geo_point(user_data.google_location),
+        "password_hash": await hash_password(password),
         "must_change_password": user_data.password is None,
         "is_active": True,
         "profile_points": 0,
@@ -442,7 +1292,7 @@ async def signup(user_data: UserCreate, response: Response, request: Request):
     await db.user_sessions.insert_one({
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
+        "expires_at": expires_at,
         "created_at": datetime.now(timezone.utc).isoformat()
     })
     
@@ -478,19 +1328,28 @@ async def login(request: Request, response: Response):
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if user.get("password_hash") != hash_password(password):
+    matches, needs_rehash = await password_hasher.verify(password, user.get("password_hash"))
+    if not matches:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.get("is_active"):
         raise HTTPException(status_code=401, detail="Account is inactive")
     
-    # Create session
+    # Transparently upgrade legacy SHA-256 (or weaker bcrypt) hashes
+    if needs_rehash:
+        await db.users.update_one(
+            {"user_id": user["user_id"], "password_hash": user["password_hash"]},
+            {"$set": {"password_hash": await hash_password(password)}}
+        )
+    
+    # Create session (replaces the user's previous session)
     session_token = f"sess_{uuid.uuid4().hex}"
     expires_at = datetime.now(timezone.utc) + timedelta(days=7)
     
+    await invalidate_sessions(user_id=user["user_id"])
     await db.user_sessions.update_one(
         {"user_id": user["user_id"]},
-        {"$set": {"session_token": session_token, "expires_at": expires_at.isoformat(), "created_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"session_token": session_token, "expires_at": expires_at, "created_at": datetime.now(timezone.utc).isoformat()}},
         upsert=True
     )
     
@@ -512,8 +1371,9 @@ async def change_password(request: Request, user: dict = Depends(get_current_use
     
     await db.users.update_one(
         {"user_id": user["user_id"]},
-        {"$set": {"password_hash": hash_password(new_password), "must_change_password": False}}
+        {"$set": {"password_hash": await hash_password(new_password), "must_change_password": False}}
     )
+    await invalidate_sessions(user_id=user["user_id"])
     
     await log_action(user["user_id"], user["role"], "change_password", "user", user["user_id"], {}, request)
     return {"message": "Password changed successfully"}
@@ -528,13 +1388,23 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        await invalidate_sessions(session_token=session_token)
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
 
 # ==================== USER MANAGEMENT ====================
 
 @api_router.get("/users")
-async def get_users(role: Optional[str] = None, city: Optional[str] = None, kitchen_id: Optional[str] = None, user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "sales_executive", "city_manager"]))):
+async def get_users(
+    response: Response,
+    role: Optional[str] = None,
+    city: Optional[str] = None,
+    kitchen_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    stream: bool = False,
+    user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "sales_executive", "city_manager"]))
+):
     query = {}
     if role:
         query["role"] = role
@@ -547,8 +1417,7 @@ async def get_users(role: Optional[str] = None, city: Optional[str] = None, kitc
     if user["role"] == "city_manager" and user.get("city"):
         query["city"] = user["city"]
     
-    users = await db.users.find(query, {"_id": 0, "password_hash": 0}).to_list(1000)
-    return users
+    return await paginated_find(db.users, query, {"_id": 0, "password_hash": 0}, [("user_id", ASCENDING)], response, cursor, limit, stream)
 
 @api_router.post("/users")
 async def create_user(user_data: UserCreate, request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "sales_executive"]))):
@@ -571,7 +1440,8 @@ async def create_user(user_data: UserCreate, request: Request, current_user: dic
         "city": user_data.city,
         "address": user_data.address,
         "google_location": user_data.google_location,
-        "password_hash": hash_password(password),
+        "geo": geo_point(user_data.google_location),
+        "password_hash": await hash_password(password),
         "must_change_password": True,
         "is_active": True,
         "profile_points": 0,
@@ -604,6 +1474,9 @@ async def update_user(user_id: str, updates: dict, request: Request, current_use
     
     updates.pop("password_hash", None)
     updates.pop("user_id", None)
+    updates.pop("geo", None)
+    if "google_location" in updates:
+        updates["geo"] = geo_point(updates["google_location"])
     
     await db.users.update_one({"user_id": user_id}, {"$set": updates})
     
@@ -612,6 +1485,7 @@ async def update_user(user_id: str, updates: dict, request: Request, current_use
     if user and user.get("role") == "customer":
         points = calculate_profile_points(user)
         await db.users.update_one({"user_id": user_id}, {"$set": {"profile_points": points}})
+    await invalidate_sessions(user_id=user_id)
     
     await log_action(current_user["user_id"], current_user["role"], "update_user", "user", user_id, updates, request)
     
@@ -624,6 +1498,8 @@ async def update_profile(user_id: str, profile: UserProfileUpdate, request: Requ
         raise HTTPException(status_code=403, detail="Cannot update other users")
     
     updates = {k: v for k, v in profile.model_dump().items() if v is not None}
+    if "google_location" in updates:
+        updates["geo"] = geo_point(updates["google_location"])
     
     if updates:
         await db.users.update_one({"user_id": user_id}, {"$set": updates})
@@ -633,11 +1509,76 @@ async def update_profile(user_id: str, profile: UserProfileUpdate, request: Requ
         points = calculate_profile_points(user)
         wallet_value = points  # ₹1 per point
         await db.users.update_one({"user_id": user_id}, {"$set": {"profile_points": points, "wallet_balance": wallet_value}})
+        await invalidate_sessions(user_id=user_id)
     
     await log_action(current_user["user_id"], current_user["role"], "update_profile", "user", user_id, updates, request)
     
     return await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
 
+NEARBY_CUSTOMER_FIELDS = {"_id": 0, "user_id": 1, "name": 1, "phone": 1, "city": 1, "address": 1, "google_location": 1, "kitchen_id": 1}
+
+@api_router.get("/users/nearby")
+async def get_nearby_users(
+    lat: float,
+    lng: float,
+    radius_km: float = 2,
+    role: str = "customer",
+    limit: int = 100,
+    user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "sales_executive", "city_manager"]))
+):
+    """Users within radius_km of a point, nearest first"""
+    geo = geo_point({"lat": lat, "lng": lng})
+    if not geo:
+        raise HTTPException(status_code=400, detail="Invalid lat/lng")
+    query = {"role": role, "is_active": True}
+    if user["role"] == "city_manager" and user.get("city"):
+        query["city"] = user["city"]
+    
+    limit = min(max(limit, 1), 500)
+    users = await db.users.aggregate([
+        {"$geoNear": {"near": geo, "distanceField": "distance_m", "maxDistance": radius_km * 1000, "query": query, "spherical": True}},
+        {"$limit": limit},
+        {"$project": {**NEARBY_CUSTOMER_FIELDS, "distance_m": 1}}
+    ]).to_list(limit)
+    for u in users:
+        u["distance_km"] = round(u.pop("distance_m") / 1000, 2)
+    return users
+
+@api_router.get("/users/near-route")
+async def get_users_near_route(
+    delivery_boy_id: str,
+    date: Optional[str] = None,
+    radius_km: float = 1,
+    limit: int = 200,
+    user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "sales_executive", "city_manager"]))
+):
+    """Customers within radius_km of any stop on a rider's route who are not already on it"""
+    delivery_date = parse_date(date).strftime("%Y-%m-%d") if date else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    stops = await db.deliveries.find(
+        {"delivery_boy_id": delivery_boy_id, "delivery_date": delivery_date, "geo": {"$ne": None}},
+        {"_id": 0, "user_id": 1, "geo": 1}
+    ).to_list(None)
+    # One $geoWithin clause per distinct stop (rounded to ~10 m)
+    points = {(round(stop["geo"]["coordinates"][0], 4), round(stop["geo"]["coordinates"][1], 4)) for stop in stops}
+    if not points:
+        return {"date": delivery_date, "stops": 0, "customers": []}
+    
+    query = {
+        "role": "customer",
+        "is_active": True,
+        "user_id": {"$nin": list({stop["user_id"] for stop in stops})},
+        "$or": [{"geo": {"$geoWithin": {"$centerSphere": [[lng, lat], radius_km / EARTH_RADIUS_KM]}}} for lng, lat in points]
+    }
+    if user["role"] == "city_manager" and user.get("city"):
+        query["city"] = user["city"]
+    limit = min(max(limit, 1), 1000)
+    customers = await db.users.find(query, {**NEARBY_CUSTOMER_FIELDS, "geo": 1}).to_list(limit)
+    for customer in customers:
+        lng, lat = customer.pop("geo")["coordinates"]
+        customer["nearest_stop_km"] = round(min(haversine_km(lat, lng, p_lat, p_lng) for p_lng, p_lat in points), 2)
+    customers.sort(key=lambda c: c["nearest_stop_km"])
+    return {"date": delivery_date, "stops": len(points), "customers": customers}
+
 @api_router.get("/users/{user_id}")
 async def get_user(user_id: str, current_user: dict = Depends(get_current_user)):
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
@@ -653,6 +1594,7 @@ async def delete_user(user_id: str, request: Request, current_user: dict = Depen
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
     
     await db.users.update_one({"user_id": user_id}, {"$set": {"is_active": False}})
+    await invalidate_sessions(user_id=user_id)
     await log_action(current_user["user_id"], current_user["role"], "delete_user", "user", user_id, {}, request)
     return {"message": "User deleted"}
 
@@ -681,20 +1623,52 @@ async def create_kitchen(request: Request, current_user: dict = Depends(require_
     kitchen = KitchenBase(**body)
     doc = kitchen.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
+    doc["geo"] = geo_point(kitchen.location)
     await db.kitchens.insert_one(doc)
     
     await log_action(current_user["user_id"], current_user["role"], "create_kitchen", "kitchen", kitchen.kitchen_id, {"city": body.get("city")}, request)
+    await catalog_cache.invalidate("kitchens")
     
     return await db.kitchens.find_one({"kitchen_id": kitchen.kitchen_id}, {"_id": 0})
 
 @api_router.get("/kitchens")
-async def get_kitchens(city: Optional[str] = None, include_inactive: bool = False):
+async def get_kitchens(request: Request, city: Optional[str] = None, include_inactive: bool = False):
     query = {}
     if not include_inactive:
         query["is_active"] = True
     if city:
         query["city"] = city
-    return await db.kitchens.find(query, {"_id": 0}).to_list(100)
+    return await cached_catalog(request, "kitchens", (city, include_inactive), lambda: db.kitchens.find(query, {"_id": 0}).to_list(100))
+
+KITCHEN_SUGGEST_MAX_KM = float(os.environ.get("KITCHEN_SUGGEST_MAX_KM", "25"))
+
+async def find_nearest_kitchens(geo: dict, max_km: float, limit: int = 5, city: Optional[str] = None) -> List[dict]:
+    """Active kitchens ordered by distance from a GeoJSON point, with distance_km"""
+    query = {"is_active": True}
+    if city:
+        query["city"] = city
+    kitchens = await db.kitchens.aggregate([
+        {"$geoNear": {
+            "near": geo,
+            "distanceField": "distance_m",
+            "maxDistance": max_km * 1000,
+            "query": query,
+            "spherical": True
+        }},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "geo": 0}}
+    ]).to_list(limit)
+    for kitchen in kitchens:
+        kitchen["distance_km"] = round(kitchen.pop("distance_m") / 1000, 2)
+    return kitchens
+
+@api_router.get("/kitchens/nearest")
+async def get_nearest_kitchens(lat: float, lng: float, max_km: float = KITCHEN_SUGGEST_MAX_KM, limit: int = 5, city: Optional[str] = None):
+    """Active kitchens closest to a point"""
+    geo = geo_point({"lat": lat, "lng": lng})
+    if not geo:
+        raise HTTPException(status_code=400, detail="Invalid lat/lng")
+    return await find_nearest_kitchens(geo, max_km, min(max(limit, 1), 50), city)
 
 @api_router.get("/kitchens/{kitchen_id}")
 async def get_kitchen(kitchen_id: str):
@@ -708,9 +1682,13 @@ async def update_kitchen(kitchen_id: str, request: Request, current_user: dict =
     """Update kitchen - Admin only"""
     body = await request.json()
     body.pop("kitchen_id", None)  # Prevent ID change
+    body.pop("geo", None)
+    if "location" in body:
+        body["geo"] = geo_point(body["location"])
     
     await db.kitchens.update_one({"kitchen_id": kitchen_id}, {"$set": body})
     await log_action(current_user["user_id"], current_user["role"], "update_kitchen", "kitchen", kitchen_id, body, request)
+    await catalog_cache.invalidate("kitchens")
     
     return await db.kitchens.find_one({"kitchen_id": kitchen_id}, {"_id": 0})
 
@@ -719,10 +1697,47 @@ async def delete_kitchen(kitchen_id: str, request: Request, current_user: dict =
     """Soft delete kitchen - Admin only"""
     await db.kitchens.update_one({"kitchen_id": kitchen_id}, {"$set": {"is_active": False}})
     await log_action(current_user["user_id"], current_user["role"], "delete_kitchen", "kitchen", kitchen_id, {}, request)
+    await catalog_cache.invalidate("kitchens")
     return {"message": "Kitchen deleted"}
 
 # ==================== PLAN ENDPOINTS ====================
 
+# Store a denormalized items_details snapshot on plan documents so plan detail reads skip menu_items
+PLAN_ITEM_SNAPSHOTS = os.environ.get("PLAN_ITEM_SNAPSHOTS", "true").lower() == "true"
+PLAN_LIST_PROJECTION = {"_id": 0, "items_details": 0, "items_version": 0}
+
+async def write_plan_snapshot(plan_id: str, selected_items: List[str], items_by_id: Optional[Dict[str, dict]] = None) -> List[dict]:
+    """Store the hydrated items on the plan, bumping items_version.
+
+    Conditioned on selected_items so a concurrent plan edit is never overwritten with a stale list.
+    """
+    if items_by_id is None:
+        items_by_id = await load_menu_items_by_ids(selected_items)
+    items_details = hydrate_plan_items(selected_items, items_by_id)
+    if PLAN_ITEM_SNAPSHOTS:
+        await db.plans.update_one(
+            {"plan_id": plan_id, "selected_items": selected_items},
+            {"$set": {"items_details": items_details}, "$inc": {"items_version": 1}}
+        )
+    return items_details
+
+async def refresh_plan_snapshots(item_id: str) -> int:
+    """Rebuild the snapshot of every plan referencing item_id; one menu_items read for all of them"""
+    if not PLAN_ITEM_SNAPSHOTS:
+        return 0
+    plans = await db.plans.find({"selected_items": item_id}, {"_id": 0, "plan_id": 1, "selected_items": 1}).to_list(None)
+    if not plans:
+        return 0
+    items_by_id = await load_menu_items_by_ids(iid for plan in plans for iid in plan["selected_items"])
+    await db.plans.bulk_write([
+        UpdateOne(
+            {"plan_id": plan["plan_id"], "selected_items": plan["selected_items"]},
+            {"$set": {"items_details": hydrate_plan_items(plan["selected_items"], items_by_id)}, "$inc": {"items_version": 1}}
+        )
+        for plan in plans
+    ], ordered=False)
+    return len(plans)
+
 @api_router.post("/plans")
 async def create_plan(request: Request, current_user: dict = Depends(require_roles(["super_admin"]))):
     body = await request.json()
@@ -749,23 +1764,26 @@ async def create_plan(request: Request, current_user: dict = Depends(require_rol
     # Validate selected items count - can't exceed delivery days
     if len(plan.selected_items) > plan.delivery_days:
         raise HTTPException(status_code=400, detail=f"Cannot select more than {plan.delivery_days} menu items for this plan")
+    await validate_menu_item_ids(plan.selected_items)
     
     doc = plan.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.plans.insert_one(doc)
+    await write_plan_snapshot(plan.plan_id, plan.selected_items)
     
     await log_action(current_user["user_id"], current_user["role"], "create_plan", "plan", plan.plan_id, body, request)
+    await catalog_cache.invalidate("plans")
     
-    return await db.plans.find_one({"plan_id": plan.plan_id}, {"_id": 0})
+    return await db.plans.find_one({"plan_id": plan.plan_id}, {"_id": 0, "items_version": 0})
 
 @api_router.get("/plans")
-async def get_plans(diet_type: Optional[str] = None, include_inactive: bool = False):
+async def get_plans(request: Request, diet_type: Optional[str] = None, include_inactive: bool = False):
     query = {}
     if not include_inactive:
         query["is_active"] = True
     if diet_type:
         query["diet_type"] = diet_type
-    return await db.plans.find(query, {"_id": 0}).to_list(100)
+    return await cached_catalog(request, "plans", (diet_type, include_inactive), lambda: db.plans.find(query, PLAN_LIST_PROJECTION).to_list(100))
 
 @api_router.get("/plans/{plan_id}")
 async def get_plan(plan_id: str):
@@ -774,14 +1792,13 @@ async def get_plan(plan_id: str):
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
-    # Enrich with menu item details
+    # Enrich with menu item details, from the snapshot when there is one
     if plan.get("selected_items"):
-        items_details = []
-        for item_id in plan["selected_items"]:
-            menu_item = await db.menu_items.find_one({"item_id": item_id}, {"_id": 0})
-            if menu_item:
-                items_details.append(menu_item)
-        plan["items_details"] = items_details
+        if not (PLAN_ITEM_SNAPSHOTS and "items_version" in plan):
+            plan["items_details"] = await write_plan_snapshot(plan_id, plan["selected_items"])
+    else:
+        plan.pop("items_details", None)
+    plan.pop("items_version", None)
     
     return plan
 
@@ -798,21 +1815,23 @@ async def update_plan(plan_id: str, request: Request, current_user: dict = Depen
         if len(body["selected_items"]) > delivery_days:
             raise HTTPException(status_code=400, detail=f"Cannot select more than {delivery_days} items")
         
-        # Validate all items exist
-        for item_id in body["selected_items"]:
-            menu_item = await db.menu_items.find_one({"item_id": item_id}, {"_id": 0})
-            if not menu_item:
-                raise HTTPException(status_code=400, detail=f"Menu item {item_id} not found")
+        await validate_menu_item_ids(body["selected_items"])
+    body.pop("items_details", None)
+    body.pop("items_version", None)
     
     await db.plans.update_one({"plan_id": plan_id}, {"$set": body})
+    if "selected_items" in body:
+        await write_plan_snapshot(plan_id, body["selected_items"])
     await log_action(current_user["user_id"], current_user["role"], "update_plan", "plan", plan_id, body, request)
-    return await db.plans.find_one({"plan_id": plan_id}, {"_id": 0})
+    await catalog_cache.invalidate("plans")
+    return await db.plans.find_one({"plan_id": plan_id}, {"_id": 0, "items_version": 0})
 
 @api_router.delete("/plans/{plan_id}")
 async def delete_plan(plan_id: str, request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
     """Soft delete plan - Super Admin and Admin only"""
     await db.plans.update_one({"plan_id": plan_id}, {"$set": {"is_active": False}})
     await log_action(current_user["user_id"], current_user["role"], "delete_plan", "plan", plan_id, {}, request)
+    await catalog_cache.invalidate("plans")
     return {"message": "Plan deleted"}
 
 # ==================== MENU MANAGEMENT ====================
@@ -823,10 +1842,11 @@ async def create_menu_item(request: Request, current_user: dict = Depends(requir
     item = MenuItemBase(**body)
     await db.menu_items.insert_one(item.model_dump())
     await log_action(current_user["user_id"], current_user["role"], "create_menu_item", "menu_item", item.item_id, body, request)
+    await catalog_cache.invalidate("menu_items")
     return await db.menu_items.find_one({"item_id": item.item_id}, {"_id": 0})
 
 @api_router.get("/menu-items")
-async def get_menu_items(category: Optional[str] = None, diet_type: Optional[str] = None, include_inactive: bool = False):
+async def get_menu_items(request: Request, category: Optional[str] = None, diet_type: Optional[str] = None, include_inactive: bool = False):
     query = {}
     if not include_inactive:
         query["is_active"] = True
@@ -834,7 +1854,7 @@ async def get_menu_items(category: Optional[str] = None, diet_type: Optional[str
         query["category"] = category
     if diet_type:
         query["diet_type"] = diet_type
-    return await db.menu_items.find(query, {"_id": 0}).to_list(500)
+    return await cached_catalog(request, "menu_items", (category, diet_type, include_inactive), lambda: db.menu_items.find(query, {"_id": 0}).to_list(500))
 
 @api_router.get("/menu-items/{item_id}")
 async def get_menu_item(item_id: str):
@@ -850,7 +1870,9 @@ async def update_menu_item(item_id: str, request: Request, current_user: dict =
     body.pop("item_id", None)  # Prevent ID change
     
     await db.menu_items.update_one({"item_id": item_id}, {"$set": body})
+    await refresh_plan_snapshots(item_id)
     await log_action(current_user["user_id"], current_user["role"], "update_menu_item", "menu_item", item_id, body, request)
+    await catalog_cache.invalidate("menu_items")
     
     return await db.menu_items.find_one({"item_id": item_id}, {"_id": 0})
 
@@ -858,7 +1880,9 @@ async def update_menu_item(item_id: str, request: Request, current_user: dict =
 async def delete_menu_item(item_id: str, request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
     """Soft delete menu item - Super Admin and Admin only"""
     await db.menu_items.update_one({"item_id": item_id}, {"$set": {"is_active": False}})
+    await refresh_plan_snapshots(item_id)
     await log_action(current_user["user_id"], current_user["role"], "delete_menu_item", "menu_item", item_id, {}, request)
+    await catalog_cache.invalidate("menu_items")
     return {"message": "Menu item deleted"}
 
 @api_router.post("/menu-templates")
@@ -930,9 +1954,19 @@ async def create_subscription(request: Request, current_user: dict = Depends(req
     
     start_date = datetime.fromisoformat(body.get("start_date").replace("Z", "+00:00"))
     
+    # Suggest the nearest kitchen when none was picked
+    kitchen_id = body.get("kitchen_id")
+    if not kitchen_id:
+        geo = user.get("geo") or geo_point(user.get("google_location"))
+        nearest = await find_nearest_kitchens(geo, KITCHEN_SUGGEST_MAX_KM, 1) if geo else []
+        if not nearest:
+            raise HTTPException(status_code=400, detail="kitchen_id is required - no kitchen found near the customer's location")
+        kitchen_id = nearest[0]["kitchen_id"]
+    
     subscription = SubscriptionBase(
         user_id=body.get("user_id"),
-        kitchen_id=body.get("kitchen_id"),
+        kitchen_id=kitchen_id,
+        city=user.get("city"),
         plan_id=body.get("plan_id"),
         plan_type=body.get("plan_type", plan.get("plan_type", "monthly")),
         diet_type=body.get("diet_type", plan.get("diet_type", "veg")),
@@ -946,77 +1980,213 @@ async def create_subscription(request: Request, current_user: dict = Depends(req
         created_by=current_user["user_id"]
     )
     
+    if not expand_delivery_calendar(subscription.start_date, subscription.delivery_days, 1):
+        raise HTTPException(status_code=400, detail="At least one delivery day (Monday-Saturday) is required")
+    
+    defer = body.get("defer_deliveries", DEFER_DELIVERY_GENERATION)
+    if isinstance(defer, str):
+        # Same parsing as the DEFER_DELIVERY_GENERATION env flag
+        defer = defer.lower() == "true"
+    elif not isinstance(defer, bool):
+        raise HTTPException(status_code=400, detail="defer_deliveries must be a boolean")
+    subscription.schedule_status = "pending" if defer else "materialized"
+    
     doc = subscription.model_dump()
     doc["start_date"] = doc["start_date"].isoformat()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.subscriptions.insert_one(doc)
     
-    # Generate deliveries
-    await generate_subscription_deliveries(subscription, user)
+    await record_revenue(subscription.created_at, subscription.city, subscription.kitchen_id, subscription_revenue=subscription.amount_paid, subscription_count=1)
     
-    # Create notification for admins/sales managers to assign delivery boy
-    notification = {
-        "notification_id": f"notif_{uuid.uuid4().hex[:12]}",
-        "user_id": None,  # Will be sent to admins/sales managers
-        "target_roles": ["super_admin", "admin", "sales_manager", "city_manager"],
-        "title": "New Subscription - Assign Delivery Boy",
-        "message": f"New subscription created for {user.get('name', 'Customer')}. Please assign a delivery boy.",
-        "type": "action_required",
-        "action_type": "assign_delivery_boy",
-        "reference_id": subscription.subscription_id,
-        "reference_type": "subscription",
-        "is_read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification)
+    # Generate deliveries (single bulk insert, or later by the background worker)
+    if defer:
+        delivery_generation_queue.put_nowait(subscription.subscription_id)
+    else:
+        await generate_subscription_deliveries(subscription, user)
+    
+    # Notify admins/sales managers to assign delivery boy
+    await notify_roles(
+        ["super_admin", "admin", "sales_manager", "city_manager"],
+        "New Subscription - Assign Delivery Boy",
+        f"New subscription created for {user.get('name', 'Customer')}. Please assign a delivery boy.",
+        "action_required",
+        action_type="assign_delivery_boy",
+        reference_id=subscription.subscription_id,
+        reference_type="subscription"
+    )
     
     await log_action(current_user["user_id"], current_user["role"], "create_subscription", "subscription", subscription.subscription_id, body, request)
     
     return await db.subscriptions.find_one({"subscription_id": subscription.subscription_id}, {"_id": 0})
 
-async def generate_subscription_deliveries(subscription: SubscriptionBase, customer: dict):
-    """Generate delivery records following menu sequence (not calendar)"""
-    current_date = subscription.start_date
-    delivery_day = 1
-    
-    day_map = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6}
-    allowed_weekdays = [day_map[d.lower()] for d in subscription.delivery_days if d.lower() in day_map]
-    
-    while delivery_day <= subscription.total_deliveries:
-        weekday = current_date.weekday()
-        
-        # Skip Sunday (holiday)
-        if weekday == 6:
-            current_date += timedelta(days=1)
-            continue
-        
-        # Check if this weekday is in customer's delivery days
-        if weekday not in allowed_weekdays:
-            current_date += timedelta(days=1)
-            continue
-        
-        # Create delivery for each meal period
+WEEKDAY_INDEX = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6}
+
+def expand_delivery_calendar(start_date: datetime, delivery_days: List[str], total_days: int, start_day_number: int = 1) -> List[tuple]:
+    """Expand a subscription into (date, delivery_day_number) pairs.
+
+    Sunday is always a holiday and only the customer's delivery weekdays are used.
+    Returns an empty list when no usable weekday is selected.
+    """
+    allowed_weekdays = {WEEKDAY_INDEX[d.lower()] for d in delivery_days if d.lower() in WEEKDAY_INDEX}
+    allowed_weekdays.discard(6)  # Sunday holiday
+    if not allowed_weekdays or total_days <= 0:
+        return []
+    
+    calendar = []
+    current_date = start_date
+    day_number = start_day_number
+    while len(calendar) < total_days:
+        if current_date.weekday() in allowed_weekdays:
+            calendar.append((current_date, day_number))
+            day_number += 1
+        current_date += timedelta(days=1)
+    return calendar
+
+def build_delivery_docs(subscription: SubscriptionBase, customer: dict, calendar: List[tuple]) -> List[dict]:
+    """Build delivery documents for every (date, day number) x meal period"""
+    address = customer.get("address") or ""
+    location = customer.get("google_location") or {"lat": 0, "lng": 0}
+    geo = geo_point(location)
+    allergy_notes = ", ".join(customer.get("allergies", []))
+    created_at = datetime.now(timezone.utc).isoformat()
+    
+    docs = []
+    for delivery_date, day_number in calendar:
+        date_str = delivery_date.strftime("%Y-%m-%d")
         for meal_period in subscription.meal_periods:
             delivery = DeliveryBase(
                 subscription_id=subscription.subscription_id,
                 user_id=subscription.user_id,
                 kitchen_id=subscription.kitchen_id,
-                delivery_date=current_date.strftime("%Y-%m-%d"),
-                delivery_day_number=delivery_day,
+                delivery_boy_id=subscription.assigned_delivery_boy_id,
+                delivery_date=date_str,
+                delivery_day_number=day_number,
                 meal_period=meal_period,
-                address=customer.get("address", ""),
-                location=customer.get("google_location", {"lat": 0, "lng": 0}),
-                allergy_notes=", ".join(customer.get("allergies", []))
+                diet_type=subscription.diet_type,
+                address=address,
+                location=location,
+                allergy_notes=allergy_notes
             )
             doc = delivery.model_dump()
-            doc["created_at"] = doc["created_at"].isoformat()
-            await db.deliveries.insert_one(doc)
+            doc["created_at"] = created_at
+            doc["geo"] = geo
+            docs.append(doc)
+    return docs
+
+async def generate_subscription_deliveries(subscription: SubscriptionBase, customer: dict):
+    """Generate delivery records following menu sequence (not calendar)"""
+    calendar = expand_delivery_calendar(subscription.start_date, subscription.delivery_days, subscription.total_deliveries)
+    docs = build_delivery_docs(subscription, customer, calendar)
+    if docs:
+        await db.deliveries.insert_many(docs, ordered=True)
+        for doc in docs:
+            production_sheets.apply(doc, 1)
+    return len(docs)
+
+async def extend_subscription_schedule(source: dict, count: int = 1) -> List[dict]:
+    """Extend a subscription by count deliveries replacing the cancelled/skipped source delivery.
+
+    The replacements go after the last delivery of the same meal period and continue its
+    day numbers. Address, location and allergy notes are copied from the source, so this
+    reads only the subscription and one indexed "last delivery" document.
+    Concurrent extensions are serialised by a conditional update of the subscription's
+    last_scheduled.<meal_period> tail; the loser re-reads it and schedules after the winner.
+    """
+    sub = await db.subscriptions.find_one_and_update(
+        {"subscription_id": source["subscription_id"]},
+        {"$inc": {"extended_deliveries": count, "total_deliveries": count}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    # Pending schedules are generated later from total_deliveries, which already includes the extension
+    if not sub or sub.get("schedule_status") == "pending":
+        return []
+    
+    meal_period = source["meal_period"]
+    tail_field = f"last_scheduled.{meal_period}"
+    tomorrow = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    while True:
+        tail = (sub.get("last_scheduled") or {}).get(meal_period)
+        last = await db.deliveries.find_one(
+            {"subscription_id": sub["subscription_id"], "meal_period": meal_period},
+            {"_id": 0, "delivery_date": 1, "delivery_day_number": 1},
+            sort=[("delivery_date", DESCENDING)]
+        )
+        after = max([t for t in (tail, last) if t], key=lambda t: t["delivery_date"], default=None)
+        start_date = max(parse_date(after["delivery_date"]) + timedelta(days=1), tomorrow) if after else tomorrow
+        calendar = expand_delivery_calendar(start_date, sub["delivery_days"], count, (after or {}).get("delivery_day_number", 0) + 1)
+        if not calendar:
+            return []
         
-        delivery_day += 1
-        current_date += timedelta(days=1)
+        last_date, last_day_number = calendar[-1]
+        claimed = await db.subscriptions.update_one(
+            {"subscription_id": sub["subscription_id"], f"{tail_field}.delivery_date": tail["delivery_date"] if tail else {"$exists": False}},
+            {"$set": {tail_field: {"delivery_date": last_date.strftime("%Y-%m-%d"), "delivery_day_number": last_day_number}}}
+        )
+        if claimed.modified_count:
+            break
+        sub = await db.subscriptions.find_one({"subscription_id": sub["subscription_id"]}, {"_id": 0})
+    
+    subscription = SubscriptionBase(**{**sub, "meal_periods": [meal_period], "diet_type": source.get("diet_type") or sub["diet_type"]})
+    customer = {
+        "address": source.get("address"),
+        "google_location": source.get("location"),
+        "allergies": [source["allergy_notes"]] if source.get("allergy_notes") else []
+    }
+    docs = build_delivery_docs(subscription, customer, calendar)
+    await db.deliveries.insert_many(docs, ordered=True)
+    for doc in docs:
+        production_sheets.apply(doc, 1)
+    return docs
+
+# Deferred delivery generation - subscriptions are acknowledged immediately and
+# their schedule is materialized by a background worker
+DEFER_DELIVERY_GENERATION = os.environ.get("DEFER_DELIVERY_GENERATION", "false").lower() == "true"
+delivery_generation_queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+async def materialize_subscription_deliveries(subscription_id: str):
+    """Generate deliveries for a subscription whose schedule is still pending"""
+    sub = await db.subscriptions.find_one({"subscription_id": subscription_id, "schedule_status": "pending"}, {"_id": 0})
+    if not sub:
+        return
+    customer = await db.users.find_one({"user_id": sub["user_id"]}, {"_id": 0, "address": 1, "google_location": 1, "allergies": 1})
+    
+    # A previous attempt may have died between insert and status update
+    await db.deliveries.delete_many({"subscription_id": subscription_id})
+    count = await generate_subscription_deliveries(SubscriptionBase(**sub), customer or {})
+    await db.subscriptions.update_one(
+        {"subscription_id": subscription_id},
+        {"$set": {"schedule_status": "materialized", "scheduled_deliveries": count}}
+    )
+
+async def delivery_generation_worker():
+    """Background worker draining the deferred delivery generation queue"""
+    while True:
+        subscription_id = await delivery_generation_queue.get()
+        try:
+            await materialize_subscription_deliveries(subscription_id)
+        except Exception:
+            logger.exception("Failed to generate deliveries for %s", subscription_id)
+        finally:
+            delivery_generation_queue.task_done()
+
+async def requeue_pending_schedules():
+    """Re-enqueue subscriptions left pending by a previous process"""
+    pending = db.subscriptions.find({"schedule_status": "pending"}, {"_id": 0, "subscription_id": 1})
+    async for sub in pending:
+        delivery_generation_queue.put_nowait(sub["subscription_id"])
 
 @api_router.get("/subscriptions")
-async def get_subscriptions(user_id: Optional[str] = None, kitchen_id: Optional[str] = None, status: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_subscriptions(
+    response: Response,
+    user_id: Optional[str] = None,
+    kitchen_id: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     query = {}
     
     if current_user["role"] == "customer":
@@ -1029,7 +2199,8 @@ async def get_subscriptions(user_id: Optional[str] = None, kitchen_id: Optional[
     if status:
         query["status"] = status
     
-    return await db.subscriptions.find(query, {"_id": 0}).to_list(1000)
+    sort = [("created_at", DESCENDING), ("subscription_id", DESCENDING)]
+    return await paginated_find(db.subscriptions, query, {"_id": 0}, sort, response, cursor, limit, stream)
 
 @api_router.get("/subscriptions/{subscription_id}")
 async def get_subscription(subscription_id: str, current_user: dict = Depends(get_current_user)):
@@ -1091,6 +2262,7 @@ async def delete_subscription(subscription_id: str, request: Request, current_us
         {"subscription_id": subscription_id, "status": "scheduled"},
         {"$set": {"status": "cancelled", "cancellation_reason": "Subscription cancelled"}}
     )
+    production_sheets.invalidate(kitchen_id=sub["kitchen_id"])
     
     await log_action(current_user["user_id"], current_user["role"], "delete_subscription", "subscription", subscription_id, {}, request)
     
@@ -1128,14 +2300,26 @@ async def assign_delivery_boy_to_subscription(subscription_id: str, request: Req
 
 # ==================== DELIVERY ENDPOINTS ====================
 
+async def attach_customer_summaries(deliveries: List[dict]):
+    """Embed the customer block in each delivery (one batched lookup)"""
+    customers = await load_users_by_ids((d["user_id"] for d in deliveries), CUSTOMER_SUMMARY_FIELDS)
+    for d in deliveries:
+        customer = customers.get(d["user_id"])
+        if customer:
+            d["customer"] = customer_summary(customer)
+
 @api_router.get("/deliveries")
 async def get_deliveries(
+    response: Response,
     user_id: Optional[str] = None,
     kitchen_id: Optional[str] = None,
     delivery_boy_id: Optional[str] = None,
     date: Optional[str] = None,
     meal_period: Optional[str] = None,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    stream: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     query = {}
@@ -1163,21 +2347,8 @@ async def get_deliveries(
     if status:
         query["status"] = status
     
-    deliveries = await db.deliveries.find(query, {"_id": 0}).to_list(1000)
-    
-    # Enrich with customer data
-    for d in deliveries:
-        customer = await db.users.find_one({"user_id": d["user_id"]}, {"_id": 0, "password_hash": 0})
-        if customer:
-            d["customer"] = {
-                "name": customer.get("name"),
-                "phone": customer.get("phone"),
-                "alternate_phone": customer.get("alternate_phone"),
-                "address": customer.get("address"),
-                "allergies": customer.get("allergies", [])
-            }
-    
-    return deliveries
+    sort = [("delivery_date", ASCENDING), ("delivery_id", ASCENDING)]
+    return await paginated_find(db.deliveries, query, {"_id": 0}, sort, response, cursor, limit, stream, enrich=attach_customer_summaries)
 
 @api_router.post("/deliveries")
 async def create_delivery(request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "city_manager"]))):
@@ -1192,6 +2363,7 @@ async def create_delivery(request: Request, current_user: dict = Depends(require
         delivery_date=body.get("delivery_date"),
         delivery_day_number=body.get("delivery_day_number", 1),
         meal_period=body.get("meal_period", "lunch"),
+        diet_type=body.get("diet_type"),
         menu_items=body.get("menu_items", []),
         status=body.get("status", "scheduled"),
         address=body.get("address", ""),
@@ -1199,7 +2371,10 @@ async def create_delivery(request: Request, current_user: dict = Depends(require
     )
     
     doc = delivery.model_dump()
+    doc["geo"] = geo_point(delivery.location)
     await db.deliveries.insert_one(doc)
+    if doc["status"] not in PRODUCTION_EXCLUDED_STATUSES:
+        production_sheets.apply(doc, 1)
     
     await log_action(current_user["user_id"], current_user["role"], "create_delivery", "delivery", delivery.delivery_id, body, request)
     
@@ -1216,54 +2391,201 @@ async def get_todays_deliveries(kitchen_id: str, current_user: dict = Depends(re
     
     deliveries = await db.deliveries.find(query, {"_id": 0}).to_list(500)
     
-    # Enrich and group by meal period
+    # Enrich (one batched lookup) and group by meal period
+    customers = await load_users_by_ids((d["user_id"] for d in deliveries), CUSTOMER_SUMMARY_FIELDS)
     result = {"breakfast": [], "lunch": [], "dinner": []}
     for d in deliveries:
-        customer = await db.users.find_one({"user_id": d["user_id"]}, {"_id": 0, "password_hash": 0})
-        d["customer"] = customer
-        result[d["meal_period"]].append(d)
+        d["customer"] = customer_summary(customers.get(d["user_id"]))
+        result.setdefault(d["meal_period"], []).append(d)
     
     return result
 
+# Allowed status changes; cancelled/skipped go through the cancel and skip-request flows
+DELIVERY_TRANSITIONS = {
+    "scheduled": ["preparing", "ready"],
+    "preparing": ["ready"],
+    "ready": ["out_for_delivery", "in_transit"],
+    "out_for_delivery": ["in_transit", "delivered"],
+    "dispatched": ["in_transit", "delivered"],  # legacy name for out_for_delivery
+    "in_transit": ["delivered"],
+}
+DELIVERY_STATUS_TIMESTAMPS = {"ready": "marked_ready_at", "out_for_delivery": "dispatched_at", "in_transit": "dispatched_at", "delivered": "delivered_at"}
+DELIVERY_STATUS_NOTIFICATIONS = {
+    "ready": ("Food Ready!", "Your {meal} is ready and will be delivered soon.", "food_ready"),
+    "out_for_delivery": ("Out for Delivery", "Your {meal} is on the way!", "delivery_update"),
+    "delivered": ("Delivered!", "Your {meal} has been delivered. Enjoy!", "delivered"),
+}
+RENEWAL_REMINDER_AT = 3  # remaining deliveries
+BATCH_STATUS_MAX = 1000
+
+def delivery_status_updates(new_status: str) -> dict:
+    """$set for a transition; status_changed_at identifies which write won a race"""
+    now = datetime.now(timezone.utc).isoformat()
+    updates = {"status": new_status, "status_changed_at": now}
+    if new_status in DELIVERY_STATUS_TIMESTAMPS:
+        updates[DELIVERY_STATUS_TIMESTAMPS[new_status]] = now
+    return updates
+
+async def notify_delivery_status(delivery: dict, new_status: str):
+    if new_status in DELIVERY_STATUS_NOTIFICATIONS:
+        title, message, notif_type = DELIVERY_STATUS_NOTIFICATIONS[new_status]
+        await send_notification(delivery["user_id"], title, message.format(meal=delivery["meal_period"]), notif_type, delivery["delivery_id"])
+
+async def send_renewal_reminder(user_id: str):
+    await send_notification(user_id, "Renewal Reminder", f"You have only {RENEWAL_REMINDER_AT} deliveries left! Renew now to continue enjoying healthy meals.", "renewal_reminder")
+
 @api_router.put("/deliveries/{delivery_id}/status")
-async def update_delivery_status(delivery_id: str, request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager", "kitchen_manager", "delivery_boy"]))):
-    body = await request.json()
-    new_status = body.get("status")
-    
-    delivery = await db.deliveries.find_one({"delivery_id": delivery_id}, {"_id": 0})
+async def update_delivery_status(
+    delivery_id: str,
+    request: Request,
+    status: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager", "kitchen_manager", "delivery_boy"]))
+):
+    """Move a delivery along DELIVERY_TRANSITIONS (status from the JSON body or ?status=)"""
+    body = await request.json() if await request.body() else {}
+    new_status = body.get("status") or status
+    allowed_from = [current for current, targets in DELIVERY_TRANSITIONS.items() if new_status in targets]
+    if not allowed_from:
+        raise HTTPException(status_code=400, detail=f"Invalid status: {new_status}")
+    
+    # Conditioned on the current status, so concurrent or repeated taps apply once
+    delivery = await db.deliveries.find_one_and_update(
+        {"delivery_id": delivery_id, "status": {"$in": allowed_from}},
+        {"$set": delivery_status_updates(new_status)},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
     if not delivery:
-        raise HTTPException(status_code=404, detail="Delivery not found")
-    
-    updates = {"status": new_status}
-    
-    if new_status == "ready":
-        updates["marked_ready_at"] = datetime.now(timezone.utc).isoformat()
-        # Send notification
-        await send_notification(delivery["user_id"], "Food Ready!", f"Your {delivery['meal_period']} is ready and will be delivered soon.", "food_ready", delivery_id)
+        current = await db.deliveries.find_one({"delivery_id": delivery_id}, {"_id": 0})
+        if not current:
+            raise HTTPException(status_code=404, detail="Delivery not found")
+        if current["status"] == new_status:
+            return current  # double-tap: already applied
+        raise HTTPException(status_code=400, detail=f"Cannot change status from {current['status']} to {new_status}")
     
-    elif new_status == "out_for_delivery":
-        updates["dispatched_at"] = datetime.now(timezone.utc).isoformat()
-        await send_notification(delivery["user_id"], "Out for Delivery", f"Your {delivery['meal_period']} is on the way!", "delivery_update", delivery_id)
+    await notify_delivery_status(delivery, new_status)
     
-    elif new_status == "delivered":
-        updates["delivered_at"] = datetime.now(timezone.utc).isoformat()
-        await send_notification(delivery["user_id"], "Delivered!", f"Your {delivery['meal_period']} has been delivered. Enjoy!", "delivered", delivery_id)
-        
-        # Update subscription
-        await db.subscriptions.update_one(
+    if new_status == "delivered":
+        sub = await db.subscriptions.find_one_and_update(
             {"subscription_id": delivery["subscription_id"]},
-            {"$inc": {"completed_deliveries": 1, "remaining_deliveries": -1}}
+            {"$inc": {"completed_deliveries": 1, "remaining_deliveries": -1}},
+            projection={"_id": 0, "remaining_deliveries": 1},
+            return_document=ReturnDocument.AFTER
         )
-        
-        # Check if renewal reminder needed
-        sub = await db.subscriptions.find_one({"subscription_id": delivery["subscription_id"]}, {"_id": 0})
-        if sub and sub.get("remaining_deliveries", 0) == 3:
-            await send_notification(delivery["user_id"], "Renewal Reminder", "You have only 3 deliveries left! Renew now to continue enjoying healthy meals.", "renewal_reminder")
+        if sub and sub.get("remaining_deliveries") == RENEWAL_REMINDER_AT:
+            await send_renewal_reminder(delivery["user_id"])
     
-    await db.deliveries.update_one({"delivery_id": delivery_id}, {"$set": updates})
+    publish_delivery_event(delivery, new_status)
     await log_action(current_user["user_id"], current_user["role"], "update_delivery_status", "delivery", delivery_id, {"status": new_status}, request)
     
-    return await db.deliveries.find_one({"delivery_id": delivery_id}, {"_id": 0})
+    return delivery
+
+@api_router.post("/deliveries/status:batch")
+async def batch_update_delivery_status(
+    request: Request,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager", "kitchen_manager", "delivery_boy"]))
+):
+    """Apply one status to many deliveries, given delivery_ids or a filter {kitchen_id, date, meal_period, status}.
+
+    Returns a result per delivery: updated, unchanged (already in that status),
+    invalid_transition, conflict (changed concurrently) or not_found.
+    """
+    body = await request.json()
+    new_status = body.get("status")
+    allowed_from = [current for current, targets in DELIVERY_TRANSITIONS.items() if new_status in targets]
+    if not allowed_from:
+        raise HTTPException(status_code=400, detail=f"Invalid status: {new_status}")
+    
+    delivery_ids = body.get("delivery_ids")
+    filters = body.get("filter") or {}
+    if delivery_ids:
+        if len(delivery_ids) > BATCH_STATUS_MAX:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_STATUS_MAX} deliveries per batch")
+        query = {"delivery_id": {"$in": list(dict.fromkeys(delivery_ids))}}
+    elif filters.get("kitchen_id") or filters.get("date"):
+        query = {k: v for k, v in {
+            "kitchen_id": filters.get("kitchen_id"),
+            "delivery_date": parse_date(filters["date"]).strftime("%Y-%m-%d") if filters.get("date") else None,
+            "meal_period": filters.get("meal_period"),
+            "status": filters.get("status"),
+        }.items() if v}
+    else:
+        raise HTTPException(status_code=400, detail="delivery_ids or a filter with kitchen_id or date is required")
+    if current_user["role"] == "kitchen_manager":
+        query["kitchen_id"] = current_user.get("kitchen_id")
+    elif current_user["role"] == "delivery_boy":
+        query["delivery_boy_id"] = current_user["user_id"]
+    
+    deliveries = await db.deliveries.find(query, {
+        "_id": 0, "delivery_id": 1, "status": 1, "user_id": 1, "subscription_id": 1,
+        "kitchen_id": 1, "delivery_boy_id": 1, "delivery_date": 1, "meal_period": 1
+    }).to_list(BATCH_STATUS_MAX + 1)
+    if len(deliveries) > BATCH_STATUS_MAX:
+        raise HTTPException(status_code=400, detail=f"Filter matches more than {BATCH_STATUS_MAX} deliveries")
+    
+    results = {}
+    to_update = []
+    for d in deliveries:
+        if d["status"] == new_status:
+            results[d["delivery_id"]] = {"result": "unchanged", "status": d["status"]}
+        elif d["status"] not in allowed_from:
+            results[d["delivery_id"]] = {"result": "invalid_transition", "status": d["status"]}
+        else:
+            to_update.append(d)
+    
+    if to_update:
+        updates = delivery_status_updates(new_status)
+        write = await db.deliveries.bulk_write([
+            UpdateOne({"delivery_id": d["delivery_id"], "status": {"$in": allowed_from}}, {"$set": updates})
+            for d in to_update
+        ], ordered=False)
+        if write.modified_count < len(to_update):
+            # Some changed between our read and write - re-read to tell which
+            current = await db.deliveries.find(
+                {"delivery_id": {"$in": [d["delivery_id"] for d in to_update]}},
+                {"_id": 0, "delivery_id": 1, "status": 1, "status_changed_at": 1}
+            ).to_list(len(to_update))
+            current = {c["delivery_id"]: c for c in current}
+            applied = []
+            for d in to_update:
+                doc = current.get(d["delivery_id"], {})
+                if doc.get("status") == new_status and doc.get("status_changed_at") == updates["status_changed_at"]:
+                    applied.append(d)
+                else:
+                    results[d["delivery_id"]] = {"result": "conflict", "status": doc.get("status")}
+            to_update = applied
+    
+    for d in to_update:
+        results[d["delivery_id"]] = {"result": "updated", "status": new_status}
+        publish_delivery_event(d, new_status)
+        await notify_delivery_status(d, new_status)
+        await log_action(current_user["user_id"], current_user["role"], "update_delivery_status", "delivery", d["delivery_id"], {"status": new_status, "batch": True}, request)
+    
+    if new_status == "delivered" and to_update:
+        # One aggregated $inc per subscription, then one read for renewal thresholds
+        per_subscription: Dict[str, int] = {}
+        user_by_subscription = {}
+        for d in to_update:
+            per_subscription[d["subscription_id"]] = per_subscription.get(d["subscription_id"], 0) + 1
+            user_by_subscription[d["subscription_id"]] = d["user_id"]
+        await db.subscriptions.bulk_write([
+            UpdateOne({"subscription_id": sub_id}, {"$inc": {"completed_deliveries": n, "remaining_deliveries": -n}})
+            for sub_id, n in per_subscription.items()
+        ], ordered=False)
+        subs = await db.subscriptions.find(
+            {"subscription_id": {"$in": list(per_subscription)}}, {"_id": 0, "subscription_id": 1, "remaining_deliveries": 1}
+        ).to_list(len(per_subscription))
+        for sub in subs:
+            remaining = sub.get("remaining_deliveries", 0)
+            if remaining <= RENEWAL_REMINDER_AT < remaining + per_subscription[sub["subscription_id"]]:
+                await send_renewal_reminder(user_by_subscription[sub["subscription_id"]])
+    
+    requested = list(dict.fromkeys(delivery_ids)) if delivery_ids else list(results)
+    return {
+        "status": new_status,
+        "updated": len(to_update),
+        "results": [{"delivery_id": delivery_id, **results.get(delivery_id, {"result": "not_found", "status": None})} for delivery_id in requested]
+    }
 
 @api_router.put("/deliveries/{delivery_id}/cancel")
 async def cancel_delivery(delivery_id: str, request: Request, current_user: dict = Depends(get_current_user)):
@@ -1286,17 +2608,26 @@ async def cancel_delivery(delivery_id: str, request: Request, current_user: dict
         "auto_extended": True
     }
     
-    await db.deliveries.update_one({"delivery_id": delivery_id}, {"$set": updates})
-    
-    # Auto-extend subscription
-    await db.subscriptions.update_one(
-        {"subscription_id": delivery["subscription_id"]},
-        {"$inc": {"extended_deliveries": 1, "total_deliveries": 1}}
+    # Conditioned on the status so a repeated cancel cannot extend the subscription twice
+    result = await db.deliveries.update_one(
+        {"delivery_id": delivery_id, "status": {"$nin": ["cancelled", "skipped", "delivered"]}},
+        {"$set": updates}
     )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail=f"Cannot cancel a {delivery['status']} delivery")
+    if delivery["status"] not in PRODUCTION_EXCLUDED_STATUSES:
+        production_sheets.apply(delivery, -1)
+    publish_delivery_event(delivery, "cancelled")
+    
+    # Auto-extend subscription with a replacement delivery
+    replacements = await extend_subscription_schedule(delivery)
     
     await log_action(current_user["user_id"], current_user["role"], "cancel_delivery", "delivery", delivery_id, body, request)
     
-    return {"message": "Delivery cancelled and subscription extended"}
+    return {
+        "message": "Delivery cancelled and subscription extended",
+        "replacement_delivery_ids": [d["delivery_id"] for d in replacements]
+    }
 
 @api_router.put("/deliveries/{delivery_id}/request-reschedule")
 async def request_reschedule_delivery(delivery_id: str, request: Request, current_user: dict = Depends(get_current_user)):
@@ -1355,6 +2686,514 @@ async def assign_delivery(delivery_id: str, request: Request, current_user: dict
     
     return await db.deliveries.find_one({"delivery_id": delivery_id}, {"_id": 0})
 
+# ==================== MENU RESOLUTION ====================
+
+MENU_RESOLVABLE_STATUSES = ["scheduled", "preparing"]
+MENU_ITEM_SNAPSHOT_FIELDS = ["item_id", "name", "category", "diet_type", "allergy_tags", "image_url"]
+
+class MenuResolver:
+    """Lookup tables for filling delivery menus in bulk.
+
+    Built once per batch from the published templates, the subscribed plans and the
+    menu catalog; resolve() is then pure dictionary work per delivery.
+    """
+    
+    def __init__(self, templates: List[dict], plans: Dict[str, dict], items: Dict[str, dict]):
+        # (plan_type, diet_type) -> (total_days, {(day, meal_period or None): [item_id, ...]})
+        self.templates: Dict[tuple, tuple] = {}
+        for template in templates:  # newest first; keep the first published per key
+            key = (template["plan_type"], template["diet_type"])
+            if key in self.templates:
+                continue
+            slots: Dict[tuple, List[str]] = {}
+            for entry in template.get("menu_sequence", []):
+                if entry.get("item_id"):
+                    slots.setdefault((entry.get("day"), entry.get("meal_period")), []).append(entry["item_id"])
+            self.templates[key] = (template.get("total_days") or 1, slots)
+        self.plans = plans
+        self.items = items
+        # (category, diet_type) -> active items, for allergy substitutions
+        self.alternatives: Dict[tuple, List[dict]] = {}
+        for item in sorted(items.values(), key=lambda i: i["item_id"]):
+            if item.get("is_active", True):
+                self.alternatives.setdefault((item.get("category"), item.get("diet_type")), []).append(item)
+    
+    def _sequence_items(self, subscription: dict, day_number: int, meal_period: str) -> List[str]:
+        template = self.templates.get((subscription.get("plan_type"), subscription.get("diet_type")))
+        if template:
+            total_days, slots = template
+            day = (day_number - 1) % total_days + 1
+            item_ids = slots.get((day, meal_period)) or slots.get((day, None))
+            if item_ids:
+                return item_ids
+        selected = (self.plans.get(subscription.get("plan_id")) or {}).get("selected_items") or []
+        if selected:
+            return [selected[(day_number - 1) % len(selected)]]
+        return []
+    
+    def _substitute(self, item: dict, allergies: set, day_number: int) -> Optional[dict]:
+        candidates = [
+            alt for alt in self.alternatives.get((item.get("category"), item.get("diet_type")), [])
+            if not allergies & {t.lower() for t in alt.get("allergy_tags", [])}
+        ]
+        if not candidates:
+            return None
+        return candidates[day_number % len(candidates)]  # rotate so substitutions vary day to day
+    
+    def resolve(self, delivery: dict, subscription: dict, allergies: set) -> tuple:
+        """Return (menu_items, substitution count) for one delivery"""
+        menu = []
+        substitutions = 0
+        for item_id in self._sequence_items(subscription, delivery["delivery_day_number"], delivery["meal_period"]):
+            item = self.items.get(item_id)
+            if not item:
+                continue
+            conflicts = allergies & {t.lower() for t in item.get("allergy_tags", [])}
+            entry = item
+            if conflicts:
+                substitute = self._substitute(item, allergies, delivery["delivery_day_number"])
+                if substitute:
+                    entry = substitute
+                    substitutions += 1
+            snapshot = {f: entry.get(f) for f in MENU_ITEM_SNAPSHOT_FIELDS}
+            if entry is not item:
+                snapshot["substituted_for"] = item_id
+            elif conflicts:
+                snapshot["allergen_warning"] = sorted(conflicts)
+            menu.append(snapshot)
+        return menu, substitutions
+
+async def build_menu_resolver(subscriptions: List[dict]) -> MenuResolver:
+    """Load templates, plans and menu items for a non-empty batch with one query each"""
+    keys = {(s.get("plan_type"), s.get("diet_type")) for s in subscriptions}
+    plan_ids = list({s.get("plan_id") for s in subscriptions if s.get("plan_id")})
+    templates_query = {"is_published": True, "$or": [{"plan_type": pt, "diet_type": dt} for pt, dt in keys]}
+    templates, plans = await asyncio.gather(
+        db.menu_templates.find(templates_query, {"_id": 0}).sort("created_at", -1).to_list(None),
+        db.plans.find({"plan_id": {"$in": plan_ids}}, {"_id": 0, "plan_id": 1, "selected_items": 1}).to_list(None),
+    )
+    referenced = {e.get("item_id") for t in templates for e in t.get("menu_sequence", []) if e.get("item_id")}
+    referenced.update(iid for p in plans for iid in p.get("selected_items", []))
+    items = await db.menu_items.find(
+        {"$or": [{"is_active": True}, {"item_id": {"$in": list(referenced)}}]},
+        {"_id": 0, "is_active": 1, **{f: 1 for f in MENU_ITEM_SNAPSHOT_FIELDS}}
+    ).to_list(None)
+    return MenuResolver(templates, {p["plan_id"]: p for p in plans}, {i["item_id"]: i for i in items})
+
+async def resolve_delivery_menus(delivery_date: str, kitchen_id: Optional[str] = None, overwrite: bool = False) -> dict:
+    """Fill menu_items for every open delivery on a date (optionally one kitchen) with one bulk write"""
+    query = {"delivery_date": delivery_date, "status": {"$in": MENU_RESOLVABLE_STATUSES}}
+    if kitchen_id:
+        query["kitchen_id"] = kitchen_id
+    if not overwrite:
+        query["menu_items"] = {"$size": 0}
+    deliveries = await db.deliveries.find(
+        query, {"_id": 0, "delivery_id": 1, "subscription_id": 1, "user_id": 1, "delivery_day_number": 1, "meal_period": 1}
+    ).to_list(None)
+    result = {"date": delivery_date, "deliveries": len(deliveries), "resolved": 0, "unresolved": 0, "substitutions": 0}
+    if not deliveries:
+        return result
+    
+    subscription_ids = list({d["subscription_id"] for d in deliveries})
+    subscriptions, customers = await asyncio.gather(
+        db.subscriptions.find(
+            {"subscription_id": {"$in": subscription_ids}},
+            {"_id": 0, "subscription_id": 1, "plan_id": 1, "plan_type": 1, "diet_type": 1}
+        ).to_list(len(subscription_ids)),
+        load_users_by_ids((d["user_id"] for d in deliveries), ["allergies"]),
+    )
+    resolver = await build_menu_resolver(subscriptions)
+    subscriptions_by_id = {s["subscription_id"]: s for s in subscriptions}
+    
+    resolved_at = datetime.now(timezone.utc).isoformat()
+    updates = []
+    for delivery in deliveries:
+        subscription = subscriptions_by_id.get(delivery["subscription_id"])
+        if not subscription:
+            result["unresolved"] += 1
+            continue
+        allergies = {a.lower() for a in (customers.get(delivery["user_id"]) or {}).get("allergies", [])}
+        menu, substitutions = resolver.resolve(delivery, subscription, allergies)
+        if not menu:
+            result["unresolved"] += 1
+            continue
+        result["resolved"] += 1
+        result["substitutions"] += substitutions
+        updates.append(UpdateOne(
+            {"delivery_id": delivery["delivery_id"], "status": {"$in": MENU_RESOLVABLE_STATUSES}},
+            {"$set": {"menu_items": menu, "menu_resolved_at": resolved_at}}
+        ))
+    if updates:
+        await db.deliveries.bulk_write(updates, ordered=False)
+        production_sheets.invalidate(kitchen_id=kitchen_id, delivery_date=delivery_date)
+    return result
+
+@api_router.post("/deliveries/resolve-menus")
+async def resolve_menus(request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "kitchen_manager"]))):
+    """Fill delivery menus for a date from published templates (plan items as fallback)"""
+    body = await request.json() if await request.body() else {}
+    delivery_date = parse_date(body["date"]).strftime("%Y-%m-%d") if body.get("date") else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    kitchen_id = body.get("kitchen_id")
+    if current_user["role"] == "kitchen_manager":
+        # Without a kitchen the resolve would cover every kitchen
+        kitchen_id = current_user.get("kitchen_id")
+        if not kitchen_id:
+            raise HTTPException(status_code=403, detail="No kitchen assigned")
+    
+    result = await resolve_delivery_menus(delivery_date, kitchen_id, bool(body.get("overwrite", False)))
+    await log_action(current_user["user_id"], current_user["role"], "resolve_menus", "delivery", kitchen_id or "all", result, request)
+    return result
+
+# ==================== ROUTE PLANNING ====================
+
+ROUTE_EXCLUDED_STATUSES = ["delivered", "cancelled", "skipped"]
+RIDER_SPEED_KMPH = float(os.environ.get("RIDER_SPEED_KMPH", "20"))
+ROUTE_CACHE_SIZE = 1000
+
+# (rider, date, meal_period) -> (fingerprint of stops and origin, planned route)
+_route_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def build_route(origin: Optional[dict], deliveries: List[dict]) -> dict:
+    """Group deliveries into stops (same point = one stop) and order them"""
+    stops: Dict[tuple, dict] = {}
+    unlocated = []
+    for d in deliveries:
+        if not d.get("geo"):
+            unlocated.append(d["delivery_id"])
+            continue
+        lng, lat = d["geo"]["coordinates"]
+        stop = stops.setdefault((round(lat, 5), round(lng, 5)), {
+            "location": {"lat": lat, "lng": lng},
+            "address": d.get("address"),
+            "user_ids": [],
+            "delivery_ids": [],
+            "meal_periods": []
+        })
+        stop["delivery_ids"].append(d["delivery_id"])
+        if d["user_id"] not in stop["user_ids"]:
+            stop["user_ids"].append(d["user_id"])
+        if d["meal_period"] not in stop["meal_periods"]:
+            stop["meal_periods"].append(d["meal_period"])
+    
+    stop_list = list(stops.values())
+    origin_point = (origin["lat"], origin["lng"]) if geo_point(origin) else None
+    order, legs = plan_route(origin_point, [(s["location"]["lat"], s["location"]["lng"]) for s in stop_list])
+    
+    route = []
+    distance = 0.0
+    for sequence, (index, leg) in enumerate(zip(order, legs), start=1):
+        distance += leg
+        route.append({
+            **stop_list[index],
+            "sequence": sequence,
+            "leg_km": round(leg, 2),
+            "cumulative_km": round(distance, 2),
+            "eta_minutes": round(distance / RIDER_SPEED_KMPH * 60) if RIDER_SPEED_KMPH > 0 else None
+        })
+    return {
+        "origin": origin if origin_point else None,
+        "stops": route,
+        "total_km": round(distance, 2),
+        "deliveries": len(deliveries),
+        "unlocated_delivery_ids": unlocated
+    }
+
+@api_router.get("/deliveries/route")
+async def get_delivery_route(
+    delivery_boy_id: Optional[str] = None,
+    date: Optional[str] = None,
+    meal_period: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager", "kitchen_manager", "delivery_boy"]))
+):
+    """Optimized stop order for a rider's open deliveries, starting at the kitchen"""
+    if current_user["role"] == "delivery_boy":
+        delivery_boy_id = current_user["user_id"]
+    if not delivery_boy_id:
+        raise HTTPException(status_code=400, detail="delivery_boy_id is required")
+    delivery_date = parse_date(date).strftime("%Y-%m-%d") if date else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    
+    query = {"delivery_boy_id": delivery_boy_id, "delivery_date": delivery_date, "status": {"$nin": ROUTE_EXCLUDED_STATUSES}}
+    if meal_period:
+        query["meal_period"] = meal_period
+    deliveries = await db.deliveries.find(
+        query, {"_id": 0, "delivery_id": 1, "user_id": 1, "kitchen_id": 1, "meal_period": 1, "address": 1, "geo": 1}
+    ).sort("delivery_id", 1).to_list(None)
+    
+    kitchen_ids = sorted({d["kitchen_id"] for d in deliveries})
+    kitchen = await db.kitchens.find_one({"kitchen_id": kitchen_ids[0]}, {"_id": 0, "kitchen_id": 1, "location": 1}) if kitchen_ids else None
+    origin = kitchen.get("location") if kitchen else None
+    
+    # Re-plan only when the set of stops (or the origin) changed
+    fingerprint = hashlib.sha1(json.dumps(
+        [origin, [(d["delivery_id"], d.get("geo"), d.get("address")) for d in deliveries]], default=str
+    ).encode()).hexdigest()
+    key = (delivery_boy_id, delivery_date, meal_period)
+    cached = _route_cache.get(key)
+    if cached and cached[0] == fingerprint:
+        _route_cache.move_to_end(key)
+        route = cached[1]
+    else:
+        route = build_route(origin, deliveries)
+        _route_cache[key] = (fingerprint, route)
+        while len(_route_cache) > ROUTE_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+    
+    return {
+        "delivery_boy_id": delivery_boy_id,
+        "date": delivery_date,
+        "meal_period": meal_period,
+        "kitchen_id": kitchen["kitchen_id"] if kitchen else None,
+        **route
+    }
+
+# ==================== RIDER ASSIGNMENT ====================
+
+# Meals a rider can carry per meal period unless their user document sets capacity_per_meal
+RIDER_CAPACITY_PER_MEAL = int(os.environ.get("RIDER_CAPACITY_PER_MEAL", "40"))
+
+@api_router.post("/kitchens/{kitchen_id}/assign-riders")
+async def auto_assign_riders(
+    kitchen_id: str,
+    request: Request,
+    dry_run: bool = False,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager", "city_manager"]))
+):
+    """Cluster a kitchen's active subscriptions by customer location and balance them across its riders"""
+    kitchen = await db.kitchens.find_one({"kitchen_id": kitchen_id}, {"_id": 0, "city": 1})
+    if not kitchen:
+        raise HTTPException(status_code=404, detail="Kitchen not found")
+    if current_user["role"] == "city_manager" and kitchen.get("city") != current_user.get("city"):
+        raise HTTPException(status_code=403, detail="Kitchen is not in your city")
+    
+    body = await request.json() if await request.body() else {}
+    rider_query = {"role": "delivery_boy", "is_active": True}
+    if body.get("rider_ids"):
+        # Explicit riders must still belong to this kitchen or its city
+        rider_query["user_id"] = {"$in": body["rider_ids"]}
+        rider_query["$or"] = [{"kitchen_id": kitchen_id}] + ([{"city": kitchen["city"]}] if kitchen.get("city") else [])
+    else:
+        rider_query["kitchen_id"] = kitchen_id
+    riders, subscriptions = await asyncio.gather(
+        db.users.find(rider_query, {"_id": 0, "user_id": 1, "name": 1, "capacity_per_meal": 1}).sort("user_id", 1).to_list(None),
+        db.subscriptions.find(
+            {"kitchen_id": kitchen_id, "status": "active"},
+            {"_id": 0, "subscription_id": 1, "user_id": 1, "meal_periods": 1, "assigned_delivery_boy_id": 1}
+        ).to_list(None),
+    )
+    if not riders:
+        raise HTTPException(status_code=400, detail="No active delivery boys for this kitchen")
+    ignored_rider_ids = sorted(set(body.get("rider_ids") or []) - {rider["user_id"] for rider in riders})
+    
+    customers = await load_users_by_ids((sub["user_id"] for sub in subscriptions), ["geo"])
+    located = [sub for sub in subscriptions if (customers.get(sub["user_id"]) or {}).get("geo")]
+    located_ids = {sub["subscription_id"] for sub in located}
+    rider_index = {rider["user_id"]: i for i, rider in enumerate(riders)}
+    period_index = {period: i for i, period in enumerate(MEAL_PERIODS)}
+    
+    latlng = np.array([customers[sub["user_id"]]["geo"]["coordinates"][::-1] for sub in located], dtype=float).reshape(-1, 2)
+    demands = np.zeros((len(located), len(MEAL_PERIODS)))
+    for i, sub in enumerate(located):
+        for period in sub.get("meal_periods", []):
+            if period in period_index:
+                demands[i, period_index[period]] += 1
+    capacities = np.array([[rider.get("capacity_per_meal") or RIDER_CAPACITY_PER_MEAL] * len(MEAL_PERIODS) for rider in riders], dtype=float)
+    current = np.array([rider_index.get(sub.get("assigned_delivery_boy_id"), -1) for sub in located], dtype=np.int64)
+    
+    assignment, overflow = await run_in_threadpool(assign_riders, latlng, demands, capacities, current)
+    
+    changes = []
+    for i, sub in enumerate(located):
+        rider_id = riders[assignment[i]]["user_id"]
+        if rider_id != sub.get("assigned_delivery_boy_id"):
+            changes.append({
+                "subscription_id": sub["subscription_id"],
+                "user_id": sub["user_id"],
+                "from": sub.get("assigned_delivery_boy_id"),
+                "to": rider_id,
+                "over_capacity": bool(overflow[i])
+            })
+    loads = np.zeros_like(capacities)
+    np.add.at(loads, assignment, demands)
+    summary = [
+        {
+            "delivery_boy_id": rider["user_id"],
+            "name": rider.get("name"),
+            "customers": int((assignment == r).sum()),
+            "meals": {period: int(loads[r, p]) for period, p in period_index.items()},
+            "capacity_per_meal": int(capacities[r, 0])
+        }
+        for r, rider in enumerate(riders)
+    ]
+    
+    if changes and not dry_run:
+        await db.subscriptions.bulk_write([
+            UpdateOne({"subscription_id": c["subscription_id"]}, {"$set": {"assigned_delivery_boy_id": c["to"]}})
+            for c in changes
+        ], ordered=False)
+        await db.deliveries.bulk_write([
+            UpdateMany({"subscription_id": c["subscription_id"], "status": "scheduled"}, {"$set": {"delivery_boy_id": c["to"]}})
+            for c in changes
+        ], ordered=False)
+        await log_action(current_user["user_id"], current_user["role"], "auto_assign_riders", "kitchen", kitchen_id, {"changes": len(changes)}, request)
+    
+    return {
+        "kitchen_id": kitchen_id,
+        "dry_run": dry_run,
+        "subscriptions": len(subscriptions),
+        "unlocated_subscription_ids": [sub["subscription_id"] for sub in subscriptions if sub["subscription_id"] not in located_ids],
+        "over_capacity": int(overflow.sum()),
+        "changes": changes,
+        "riders": summary,
+        "ignored_rider_ids": ignored_rider_ids
+    }
+
+# ==================== KITCHEN PRODUCTION ====================
+
+# Cancelled and skipped deliveries are not cooked; every other status is
+PRODUCTION_EXCLUDED_STATUSES = ["cancelled", "skipped"]
+# Sheets are patched in place by this worker's writes; the TTL bounds staleness from other workers
+PRODUCTION_CACHE_TTL = float(os.environ.get("PRODUCTION_CACHE_TTL", "120"))
+
+def allergy_variant(allergy_notes: Optional[str]) -> str:
+    """Normalized allergy-exclusion key such as gluten, milk (or none)"""
+    allergies = sorted({a.strip().lower() for a in (allergy_notes or "").split(",") if a.strip()})
+    return ", ".join(allergies) or "none"
+
+def _empty_sheet() -> dict:
+    return {"total": 0, "unresolved": 0, "diet_types": {}, "allergy_variants": {}, "items": {}}
+
+def _bump(counter: dict, key: str, delta: int):
+    counter[key] = counter.get(key, 0) + delta
+    if counter[key] <= 0:
+        del counter[key]
+
+class ProductionSheetCache:
+    """Per (kitchen_id, date, meal_period) production counts"""
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[tuple, tuple] = {}  # key -> (sheet, cached_until)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, kitchen_id: str, delivery_date: str, meal_period: str) -> Optional[dict]:
+        entry = self._entries.get((kitchen_id, delivery_date, meal_period))
+        if entry is None or entry[1] < monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+    
+    def put(self, kitchen_id: str, delivery_date: str, meal_period: str, sheet: dict):
+        if self.ttl > 0:
+            self._entries[(kitchen_id, delivery_date, meal_period)] = (sheet, monotonic() + self.ttl)
+    
+    def apply(self, delivery: dict, delta: int):
+        """Add (+1) or remove (-1) one delivery from its cached sheet, if that sheet is cached"""
+        entry = self._entries.get((delivery.get("kitchen_id"), delivery.get("delivery_date"), delivery.get("meal_period")))
+        if entry is None or entry[1] < monotonic():
+            return
+        sheet = entry[0]
+        variant = allergy_variant(delivery.get("allergy_notes"))
+        sheet["total"] += delta
+        _bump(sheet["diet_types"], delivery.get("diet_type") or "unknown", delta)
+        _bump(sheet["allergy_variants"], variant, delta)
+        menu_items = delivery.get("menu_items") or []
+        if not menu_items:
+            sheet["unresolved"] += delta
+        for item in menu_items:
+            row = sheet["items"].setdefault(item.get("item_id"), {"name": item.get("name"), "count": 0, "variants": {}})
+            row["count"] += delta
+            _bump(row["variants"], variant, delta)
+            if row["count"] <= 0:
+                del sheet["items"][item.get("item_id")]
+    
+    def invalidate(self, kitchen_id: Optional[str] = None, delivery_date: Optional[str] = None):
+        for key in [k for k in self._entries if (kitchen_id is None or k[0] == kitchen_id) and (delivery_date is None or k[1] == delivery_date)]:
+            del self._entries[key]
+    
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+production_sheets = ProductionSheetCache(PRODUCTION_CACHE_TTL)
+
+async def compute_production_sheets(kitchen_id: str, delivery_date: str) -> Dict[str, dict]:
+    """Count every meal period of a kitchen-date in one aggregation"""
+    result = await db.deliveries.aggregate([
+        {"$match": {"kitchen_id": kitchen_id, "delivery_date": delivery_date, "status": {"$nin": PRODUCTION_EXCLUDED_STATUSES}}},
+        {"$facet": {
+            "variants": [
+                {"$group": {
+                    "_id": {
+                        "meal_period": "$meal_period",
+                        "diet_type": "$diet_type",
+                        "allergy_notes": "$allergy_notes",
+                        "resolved": {"$gt": [{"$size": {"$ifNull": ["$menu_items", []]}}, 0]}
+                    },
+                    "count": {"$sum": 1}
+                }}
+            ],
+            "items": [
+                {"$unwind": "$menu_items"},
+                {"$group": {
+                    "_id": {"meal_period": "$meal_period", "item_id": "$menu_items.item_id", "allergy_notes": "$allergy_notes"},
+                    "name": {"$first": "$menu_items.name"},
+                    "count": {"$sum": 1}
+                }}
+            ]
+        }}
+    ]).to_list(1)
+    facets = result[0] if result else {"variants": [], "items": []}
+    
+    sheets = {period: _empty_sheet() for period in MEAL_PERIODS}
+    for row in facets["variants"]:
+        key = row["_id"]
+        sheet = sheets.setdefault(key["meal_period"], _empty_sheet())
+        sheet["total"] += row["count"]
+        if not key.get("resolved"):
+            sheet["unresolved"] += row["count"]
+        _bump(sheet["diet_types"], key.get("diet_type") or "unknown", row["count"])
+        _bump(sheet["allergy_variants"], allergy_variant(key.get("allergy_notes")), row["count"])
+    for row in facets["items"]:
+        key = row["_id"]
+        item = sheets.setdefault(key["meal_period"], _empty_sheet())["items"].setdefault(
+            key["item_id"], {"name": row["name"], "count": 0, "variants": {}}
+        )
+        item["count"] += row["count"]
+        _bump(item["variants"], allergy_variant(key.get("allergy_notes")), row["count"])
+    return sheets
+
+def format_production_sheet(sheet: dict) -> dict:
+    items = [{"item_id": item_id, **row} for item_id, row in sheet["items"].items()]
+    items.sort(key=lambda row: (-row["count"], row["name"] or ""))
+    return {**sheet, "items": items}
+
+@api_router.get("/kitchens/{kitchen_id}/production")
+async def get_production_sheet(
+    kitchen_id: str,
+    date: Optional[str] = None,
+    meal_period: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager", "kitchen_manager"]))
+):
+    """Per meal period counts of menu items, diet types and allergy-exclusion variants"""
+    if current_user["role"] == "kitchen_manager" and current_user.get("kitchen_id") != kitchen_id:
+        raise HTTPException(status_code=403, detail="Not your kitchen")
+    delivery_date = parse_date(date).strftime("%Y-%m-%d") if date else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    periods = [meal_period] if meal_period else MEAL_PERIODS
+    
+    sheets = {period: production_sheets.get(kitchen_id, delivery_date, period) for period in periods}
+    if any(sheet is None for sheet in sheets.values()):
+        computed = await compute_production_sheets(kitchen_id, delivery_date)
+        for period, sheet in computed.items():
+            production_sheets.put(kitchen_id, delivery_date, period, sheet)
+        sheets = {period: computed.get(period, _empty_sheet()) for period in periods}
+    
+    return {
+        "kitchen_id": kitchen_id,
+        "date": delivery_date,
+        "meal_periods": {period: format_production_sheet(sheet) for period, sheet in sheets.items()}
+    }
+
 # ==================== ALTERNATIVE DELIVERY REQUESTS ====================
 
 @api_router.post("/delivery-requests")
@@ -1380,11 +3219,19 @@ async def create_delivery_request(request: Request, current_user: dict = Depends
     return await db.delivery_requests.find_one({"request_id": req.request_id}, {"_id": 0})
 
 @api_router.get("/delivery-requests")
-async def get_delivery_requests(status: Optional[str] = None, current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))):
+async def get_delivery_requests(
+    response: Response,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 500,
+    stream: bool = False,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))
+):
     query = {}
     if status:
         query["status"] = status
-    return await db.delivery_requests.find(query, {"_id": 0}).to_list(500)
+    sort = [("created_at", DESCENDING), ("request_id", DESCENDING)]
+    return await paginated_find(db.delivery_requests, query, {"_id": 0}, sort, response, cursor, limit, stream)
 
 @api_router.put("/delivery-requests/{request_id}")
 async def review_delivery_request(request_id: str, request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))):
@@ -1406,18 +3253,17 @@ async def review_delivery_request(request_id: str, request: Request, current_use
     
     if action == "approve":
         if req["request_type"] == "skip":
-            # Cancel the delivery and auto-extend
-            await db.deliveries.update_one(
-                {"delivery_id": req["delivery_id"]},
-                {"$set": {"status": "skipped", "auto_extended": True}}
+            # Cancel the delivery and auto-extend (returns the document as it was before)
+            delivery = await db.deliveries.find_one_and_update(
+                {"delivery_id": req["delivery_id"], "status": {"$nin": ["cancelled", "skipped", "delivered"]}},
+                {"$set": {"status": "skipped", "auto_extended": True}},
+                projection={"_id": 0}
             )
-            # Get subscription and extend
-            delivery = await db.deliveries.find_one({"delivery_id": req["delivery_id"]}, {"_id": 0})
             if delivery:
-                await db.subscriptions.update_one(
-                    {"subscription_id": delivery["subscription_id"]},
-                    {"$inc": {"extended_deliveries": 1, "total_deliveries": 1}}
-                )
+                if delivery["status"] not in PRODUCTION_EXCLUDED_STATUSES:
+                    production_sheets.apply(delivery, -1)
+                publish_delivery_event(delivery, "skipped")
+                await extend_subscription_schedule(delivery)
     
     await log_action(current_user["user_id"], current_user["role"], "review_delivery_request", "delivery_request", request_id, body, request)
     
@@ -1425,8 +3271,30 @@ async def review_delivery_request(request_id: str, request: Request, current_use
 
 # ==================== NOTIFICATIONS ====================
 
+# Direct notifications carry user_id and their own is_read flag. Role broadcasts
+# (target_roles) are shared, so each user's read state lives in notification_reads
+# plus a per-role "read everything up to" watermark on their counter document.
+
+async def _notification_state(current_user: dict) -> tuple:
+    """Return (user counter doc, role counter doc) in one round trip"""
+    role_key = f"role:{current_user['role']}"
+    docs = await db.notification_counters.find({"_id": {"$in": [current_user["user_id"], role_key]}}).to_list(2)
+    by_id = {d["_id"]: d for d in docs}
+    return by_id.get(current_user["user_id"], {}), by_id.get(role_key, {})
+
+def _broadcast_watermark(user_state: dict, role: str) -> str:
+    return user_state.get("broadcast_read_until", {}).get(role, "")
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_count(current_user: dict = Depends(get_current_user)):
+    user_state, role_state = await _notification_state(current_user)
+    broadcast_read = user_state.get("broadcast_read", {}).get(current_user["role"], 0)
+    unread = max(user_state.get("unread", 0), 0) + max(role_state.get("total", 0) - broadcast_read, 0)
+    return {"unread": unread}
+
 @api_router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(get_current_user)):
+async def get_notifications(response: Response, cursor: Optional[str] = None, limit: int = 100, stream: bool = False, current_user: dict = Depends(get_current_user)):
+    """Newest-first notifications; pass the X-Next-Cursor header back as ?cursor= for the next page"""
     # Get notifications for this user OR for their role
     query = {
         "$or": [
@@ -1434,27 +3302,155 @@ async def get_notifications(current_user: dict = Depends(get_current_user)):
             {"target_roles": current_user["role"]}
         ]
     }
-    return await db.notifications.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    sort = [("created_at", DESCENDING), ("notification_id", DESCENDING)]
+    return await paginated_find(
+        db.notifications, query, {"_id": 0}, sort, response, cursor, limit, stream,
+        enrich=lambda notifications: _resolve_broadcast_reads(notifications, current_user), max_limit=200
+    )
+
+async def _resolve_broadcast_reads(notifications: List[dict], current_user: dict):
+    """Resolve per-user read state of role broadcasts"""
+    broadcast_ids = [n["notification_id"] for n in notifications if not n.get("user_id")]
+    if broadcast_ids:
+        user_state, _ = await _notification_state(current_user)
+        watermark = _broadcast_watermark(user_state, current_user["role"])
+        reads = await db.notification_reads.find(
+            {"user_id": current_user["user_id"], "notification_id": {"$in": broadcast_ids}},
+            {"_id": 0, "notification_id": 1}
+        ).to_list(len(broadcast_ids))
+        read_ids = {r["notification_id"] for r in reads}
+        for n in notifications:
+            if not n.get("user_id"):
+                # is_read on a broadcast document is a legacy, global flag
+                n["is_read"] = n.get("is_read", False) or broadcast_key(n) <= watermark or n["notification_id"] in read_ids
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
-    await db.notifications.update_one(
-        {"notification_id": notification_id}, 
-        {"$set": {"is_read": True, f"read_by.{current_user['user_id']}": True}}
+    notif = await db.notifications.find_one({"notification_id": notification_id}, {"_id": 0, "notification_id": 1, "user_id": 1, "target_roles": 1, "created_at": 1, "is_read": 1})
+    if not notif:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    
+    if notif.get("user_id"):
+        if notif["user_id"] != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Not your notification")
+        result = await db.notifications.update_one({"notification_id": notification_id, "is_read": False}, {"$set": {"is_read": True}})
+        if result.modified_count:
+            await db.notification_counters.update_one({"_id": current_user["user_id"]}, {"$inc": {"unread": -1}}, upsert=True)
+        return {"message": "Marked as read"}
+    
+    role = current_user["role"]
+    if role not in (notif.get("target_roles") or []):
+        raise HTTPException(status_code=403, detail="Not your notification")
+    user_state, _ = await _notification_state(current_user)
+    if notif.get("is_read") or broadcast_key(notif) <= _broadcast_watermark(user_state, role):
+        return {"message": "Marked as read"}
+    result = await db.notification_reads.update_one(
+        {"user_id": current_user["user_id"], "notification_id": notification_id},
+        {"$setOnInsert": {"read_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
     )
+    if result.upserted_id is not None:
+        await db.notification_counters.update_one({"_id": current_user["user_id"]}, {"$inc": {f"broadcast_read.{role}": 1}}, upsert=True)
     return {"message": "Marked as read"}
 
 @api_router.put("/notifications/read-all")
 async def mark_all_read(current_user: dict = Depends(get_current_user)):
-    query = {
-        "$or": [
-            {"user_id": current_user["user_id"]},
-            {"target_roles": current_user["role"]}
-        ]
-    }
-    await db.notifications.update_many(query, {"$set": {"is_read": True}})
+    """Mark the user's direct notifications and their role broadcasts read - for this user only"""
+    role = current_user["role"]
+    _, role_state = await _notification_state(current_user)
+    await db.notifications.update_many({"user_id": current_user["user_id"], "is_read": False}, {"$set": {"is_read": True}})
+    await db.notification_counters.update_one(
+        {"_id": current_user["user_id"]},
+        {"$set": {
+            "unread": 0,
+            # Both from the same role counter snapshot: broadcasts still queued are in neither
+            f"broadcast_read.{role}": role_state.get("total", 0),
+            f"broadcast_read_until.{role}": role_state.get("latest", datetime.now(timezone.utc).isoformat() if role_state.get("total") else "")
+        }},
+        upsert=True
+    )
+    await db.notification_reads.delete_many({"user_id": current_user["user_id"]})
     return {"message": "All marked as read"}
 
+async def rebuild_notification_counters():
+    """Seed notification_counters from existing notifications (first run only)"""
+    if await db.notification_counters.find_one({}):
+        return
+    direct = db.notifications.aggregate([
+        {"$match": {"user_id": {"$ne": None}, "is_read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ])
+    broadcasts = db.notifications.aggregate([
+        {"$match": {"user_id": None, "is_read": False}},
+        {"$unwind": "$target_roles"},
+        {"$group": {
+            "_id": {"$concat": ["role:", "$target_roles"]},
+            "total": {"$sum": 1},
+            "latest": {"$max": {"$concat": ["$created_at", " ", "$notification_id"]}}
+        }}
+    ])
+    ops = [UpdateOne({"_id": d["_id"]}, {"$set": {"unread": d["unread"]}}, upsert=True) async for d in direct]
+    ops += [UpdateOne({"_id": d["_id"]}, {"$set": {"total": d["total"], "latest": d["latest"]}}, upsert=True) async for d in broadcasts]
+    if ops:
+        await db.notification_counters.bulk_write(ops, ordered=False)
+
+# ==================== LIVE EVENTS ====================
+
+async def _event_topics(current_user: dict, kitchen_id: Optional[str]) -> List[str]:
+    topics = [f"user:{current_user['user_id']}", f"role:{current_user['role']}"]
+    if current_user["role"] == "delivery_boy":
+        topics.append(f"rider:{current_user['user_id']}")
+    elif current_user["role"] == "kitchen_manager":
+        if current_user.get("kitchen_id"):
+            topics.append(f"kitchen:{current_user['kitchen_id']}")
+    elif kitchen_id and current_user["role"] in ["super_admin", "admin", "city_manager"]:
+        if current_user["role"] == "city_manager":
+            kitchen = await db.kitchens.find_one({"kitchen_id": kitchen_id}, {"_id": 0, "city": 1})
+            if not kitchen or kitchen.get("city") != current_user.get("city"):
+                raise HTTPException(status_code=403, detail="Kitchen is not in your city")
+        topics.append(f"kitchen:{kitchen_id}")
+    return topics
+
+def _format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+@api_router.get("/events/stream")
+async def stream_events(request: Request, kitchen_id: Optional[str] = None, last_event_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Server-sent events: delivery status changes and notifications for this user's scope"""
+    topics = await _event_topics(current_user, kitchen_id)
+    resume_from = request.headers.get("Last-Event-ID") or last_event_id
+    
+    async def event_stream():
+        # Subscribe before replaying so nothing published in between is lost
+        queue = event_hub.subscribe(topics)
+        try:
+            yield "retry: 3000\n\n"
+            last_seq = 0
+            for event in event_hub.replay(topics, resume_from):
+                last_seq = event["seq"]
+                yield _format_sse(event)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if queue.overflowed:
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                if event["seq"] <= last_seq:
+                    continue
+                yield _format_sse(event)
+                if queue.overflowed and queue.empty():
+                    break
+        finally:
+            event_hub.unsubscribe(queue, topics)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ==================== BANNERS ====================
 
 @api_router.post("/banners")
@@ -1464,44 +3460,75 @@ async def create_banner(request: Request, current_user: dict = Depends(require_r
     doc = banner.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.banners.insert_one(doc)
+    await catalog_cache.invalidate("banners")
     return await db.banners.find_one({"banner_id": banner.banner_id}, {"_id": 0})
 
 @api_router.get("/banners")
-async def get_banners():
-    return await db.banners.find({"is_active": True}, {"_id": 0}).sort("display_order", 1).to_list(10)
+async def get_banners(request: Request):
+    return await cached_catalog(request, "banners", None, lambda: db.banners.find({"is_active": True}, {"_id": 0}).sort("display_order", 1).to_list(10))
 
 # ==================== REPORTS & ANALYTICS ====================
 
 @api_router.get("/reports/subscriptions")
-async def get_subscription_report(status: Optional[str] = None, city: Optional[str] = None, current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))):
-    """Get subscription reports - live, paused, expired"""
-    pipeline = []
-    
-    match = {}
-    if status:
-        match["status"] = status
-    if match:
-        pipeline.append({"$match": match})
+async def get_subscription_report(
+    status: Optional[str] = None,
+    city: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 50,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))
+):
+    """Get subscription reports - live, paused, expired counts plus one page of subscriptions"""
+    page = max(page, 1)
+    page_size = max(1, min(page_size, 200))
     
-    # Join with users to get city
-    pipeline.append({"$lookup": {"from": "users", "localField": "user_id", "foreignField": "user_id", "as": "user"}})
-    pipeline.append({"$unwind": "$user"})
+    # City manager can only see their city
+    if current_user["role"] == "city_manager" and current_user.get("city"):
+        city = current_user["city"]
     
+    # Filter on the denormalized city before any join
+    match = {}
     if city:
-        pipeline.append({"$match": {"user.city": city}})
-    
-    pipeline.append({"$project": {"_id": 0}})
-    
-    results = await db.subscriptions.aggregate(pipeline).to_list(1000)
+        match["city"] = city
+    page_match = {"status": status} if status else {}
+    
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            "counts": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "total": [{"$match": page_match}, {"$count": "count"}],
+            "page": [
+                {"$match": page_match},
+                {"$sort": {"created_at": -1, "subscription_id": 1}},
+                {"$skip": (page - 1) * page_size},
+                {"$limit": page_size},
+                {"$lookup": {
+                    "from": "users",
+                    "localField": "user_id",
+                    "foreignField": "user_id",
+                    "pipeline": [{"$project": {"_id": 0, "name": 1, "phone": 1, "city": 1}}],
+                    "as": "user"
+                }},
+                {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+                {"$project": {"_id": 0}}
+            ]
+        }}
+    ]
+    
+    result = (await db.subscriptions.aggregate(pipeline).to_list(1))[0]
+    counts = {c["_id"]: c["count"] for c in result["counts"]}
+    total = result["total"][0]["count"] if result["total"] else 0
     
-    summary = {
-        "total": len(results),
-        "active": len([r for r in results if r.get("status") == "active"]),
-        "paused": len([r for r in results if r.get("status") == "paused"]),
-        "expired": len([r for r in results if r.get("status") == "expired"]),
-        "subscriptions": results
+    return {
+        "total": total,
+        "active": counts.get("active", 0),
+        "paused": counts.get("paused", 0),
+        "expired": counts.get("expired", 0),
+        "cancelled": counts.get("cancelled", 0),
+        "page": page,
+        "page_size": page_size,
+        "has_more": page * page_size < total,
+        "subscriptions": result["page"]
     }
-    return summary
 
 @api_router.get("/reports/expiring")
 async def get_expiring_subscriptions(days: int = 3, current_user: dict = Depends(require_roles(["super_admin", "admin", "sales_manager"]))):
@@ -1512,157 +3539,867 @@ async def get_expiring_subscriptions(days: int = 3, current_user: dict = Depends
         {"_id": 0}
     ).to_list(500)
     
-    # Enrich with user data
+    # Enrich with user data (one batched lookup)
+    users = await load_users_by_ids((s["user_id"] for s in subs), ["name", "phone"])
     for s in subs:
-        user = await db.users.find_one({"user_id": s["user_id"]}, {"_id": 0, "password_hash": 0, "name": 1, "phone": 1})
-        s["user"] = user
+        s["user"] = users.get(s["user_id"])
     
     return subs
 
+# Daily revenue rollup: one document per (day, city, kitchen), updated incrementally
+# when subscriptions are created and payments verified
+
+REVENUE_PERIOD_UNITS = {"daily": "day", "weekly": "week", "monthly": "month"}
+
+async def record_revenue(when: datetime, city: Optional[str], kitchen_id: Optional[str], subscription_revenue: float = 0, subscription_count: int = 0, payments_received: float = 0, payment_count: int = 0):
+    day = datetime(when.year, when.month, when.day, tzinfo=timezone.utc)
+    await db.revenue_daily.update_one(
+        {"_id": f"{day.strftime('%Y-%m-%d')}|{city or ''}|{kitchen_id or ''}"},
+        {
+            "$inc": {
+                "subscription_revenue": subscription_revenue,
+                "subscription_count": subscription_count,
+                "payments_received": payments_received,
+                "payment_count": payment_count
+            },
+            "$setOnInsert": {"date": day, "city": city, "kitchen_id": kitchen_id}
+        },
+        upsert=True
+    )
+
+def _rollup_id_expr(date_expr: dict) -> dict:
+    return {"$concat": [
+        {"$dateToString": {"format": "%Y-%m-%d", "date": date_expr}}, "|",
+        {"$ifNull": ["$city", ""]}, "|",
+        {"$ifNull": ["$kitchen_id", ""]}
+    ]}
+
+async def rebuild_revenue_rollup():
+    """Recompute revenue_daily from subscriptions and paid payment orders"""
+    await db.revenue_daily.delete_many({})
+    await db.subscriptions.aggregate([
+        {"$addFields": {"created": {"$dateTrunc": {"date": {"$toDate": "$created_at"}, "unit": "day"}}}},
+        {"$group": {
+            "_id": _rollup_id_expr("$created"),
+            "date": {"$first": "$created"},
+            "city": {"$first": "$city"},
+            "kitchen_id": {"$first": "$kitchen_id"},
+            "subscription_revenue": {"$sum": {"$ifNull": ["$amount_paid", 0]}},
+            "subscription_count": {"$sum": 1}
+        }},
+        {"$merge": {"into": "revenue_daily", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ]).to_list(None)
+    await db.payment_orders.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$lookup": {
+            "from": "subscriptions",
+            "localField": "subscription_id",
+            "foreignField": "subscription_id",
+            "pipeline": [{"$project": {"_id": 0, "city": 1, "kitchen_id": 1}}],
+            "as": "sub"
+        }},
+        {"$addFields": {
+            "paid": {"$dateTrunc": {"date": {"$toDate": {"$ifNull": ["$paid_at", "$created_at"]}}, "unit": "day"}},
+            "city": {"$first": "$sub.city"},
+            "kitchen_id": {"$first": "$sub.kitchen_id"}
+        }},
+        {"$group": {
+            "_id": _rollup_id_expr("$paid"),
+            "date": {"$first": "$paid"},
+            "city": {"$first": "$city"},
+            "kitchen_id": {"$first": "$kitchen_id"},
+            "payments_received": {"$sum": {"$divide": [{"$ifNull": ["$amount", 0]}, 100]}},
+            "payment_count": {"$sum": 1}
+        }},
+        {"$merge": {"into": "revenue_daily", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ]).to_list(None)
+
+async def backfill_subscription_cities():
+    """Denormalize the customer's city onto subscriptions created before the field existed"""
+    await db.subscriptions.aggregate([
+        {"$match": {"city": {"$exists": False}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "pipeline": [{"$project": {"_id": 0, "city": 1}}],
+            "as": "user"
+        }},
+        {"$project": {"_id": 1, "city": {"$ifNull": [{"$first": "$user.city"}, None]}}},
+        {"$merge": {"into": "subscriptions", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]).to_list(None)
+
+async def backfill_delivery_diet_types():
+    """Denormalize the subscription's diet_type onto deliveries created before the field existed"""
+    await db.deliveries.aggregate([
+        {"$match": {"diet_type": {"$exists": False}}},
+        {"$lookup": {
+            "from": "subscriptions",
+            "localField": "subscription_id",
+            "foreignField": "subscription_id",
+            "pipeline": [{"$project": {"_id": 0, "diet_type": 1}}],
+            "as": "subscription"
+        }},
+        {"$project": {"_id": 1, "diet_type": {"$ifNull": [{"$first": "$subscription.diet_type"}, None]}}},
+        {"$merge": {"into": "deliveries", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]).to_list(None)
+
 @api_router.get("/reports/revenue")
-async def get_revenue_report(period: str = "daily", current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
-    """Get revenue report - daily, weekly, monthly"""
-    subs = await db.subscriptions.find({}, {"_id": 0, "amount_paid": 1, "created_at": 1}).to_list(10000)
+async def get_revenue_report(
+    period: str = "daily",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    kitchen_id: Optional[str] = None,
+    breakdown: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin"]))
+):
+    """Get revenue report - daily, weekly, monthly buckets from the daily rollup"""
+    if period not in REVENUE_PERIOD_UNITS:
+        raise HTTPException(status_code=400, detail="Period must be daily, weekly or monthly")
+    if breakdown not in (None, "city", "kitchen"):
+        raise HTTPException(status_code=400, detail="Breakdown must be city or kitchen")
     
-    total_revenue = sum(s.get("amount_paid", 0) for s in subs)
+    match = {}
+    if start_date or end_date:
+        match["date"] = {}
+        if start_date:
+            match["date"]["$gte"] = parse_date(start_date, "start_date")
+        if end_date:
+            match["date"]["$lte"] = parse_date(end_date, "end_date")
+    if city:
+        match["city"] = city
+    if kitchen_id:
+        match["kitchen_id"] = kitchen_id
+    
+    group_id = {"bucket": {"$dateTrunc": {"date": "$date", "unit": REVENUE_PERIOD_UNITS[period], "startOfWeek": "monday"}}}
+    if breakdown == "city":
+        group_id["city"] = "$city"
+    elif breakdown == "kitchen":
+        group_id["kitchen_id"] = "$kitchen_id"
+    
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": group_id,
+            "revenue": {"$sum": "$subscription_revenue"},
+            "subscription_count": {"$sum": "$subscription_count"},
+            "payments_received": {"$sum": "$payments_received"},
+            "payment_count": {"$sum": "$payment_count"}
+        }},
+        {"$sort": {"_id.bucket": 1}}
+    ]
+    rows = await db.revenue_daily.aggregate(pipeline).to_list(None)
+    
+    buckets = []
+    for row in rows:
+        bucket = {"period_start": row["_id"]["bucket"].strftime("%Y-%m-%d"), **{k: v for k, v in row.items() if k != "_id"}}
+        if breakdown == "city":
+            bucket["city"] = row["_id"].get("city")
+        elif breakdown == "kitchen":
+            bucket["kitchen_id"] = row["_id"].get("kitchen_id")
+        buckets.append(bucket)
     
     return {
         "period": period,
-        "total_revenue": total_revenue,
-        "subscription_count": len(subs)
+        "total_revenue": sum(b["revenue"] for b in buckets),
+        "subscription_count": sum(b["subscription_count"] for b in buckets),
+        "payments_received": sum(b["payments_received"] for b in buckets),
+        "buckets": buckets
     }
 
+@api_router.post("/reports/revenue/rebuild")
+async def rebuild_revenue_report(request: Request, current_user: dict = Depends(require_roles(["super_admin"]))):
+    """Recompute the daily revenue rollup from source collections"""
+    await backfill_subscription_cities()
+    await rebuild_revenue_rollup()
+    await log_action(current_user["user_id"], current_user["role"], "rebuild_revenue_rollup", "system", "revenue_daily", {}, request)
+    return {"message": "Revenue rollup rebuilt", "rows": await db.revenue_daily.count_documents({})}
+
 @api_router.get("/reports/delivery-boys")
-async def get_delivery_boy_report(date: Optional[str] = None, current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))):
-    """Get delivery boy activity - logged in, deliveries completed"""
-    if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    
-    delivery_boys = await db.users.find({"role": "delivery_boy", "is_active": True}, {"_id": 0, "password_hash": 0}).to_list(100)
-    
-    for db_user in delivery_boys:
-        # Get today's deliveries
-        deliveries = await db.deliveries.find(
-            {"delivery_boy_id": db_user["user_id"], "delivery_date": date},
-            {"_id": 0}
-        ).to_list(100)
-        
-        db_user["total_deliveries"] = len(deliveries)
-        db_user["completed"] = len([d for d in deliveries if d.get("status") == "delivered"])
-        db_user["pending"] = len([d for d in deliveries if d.get("status") not in ["delivered", "cancelled"]])
+async def get_delivery_boy_report(
+    date: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    city: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))
+):
+    """Get delivery boy activity for a day (date) or a range (start_date..end_date)"""
+    if start_date or end_date:
+        start = parse_date(start_date or end_date, "start_date").strftime("%Y-%m-%d")
+        end = parse_date(end_date or start_date, "end_date").strftime("%Y-%m-%d")
+    else:
+        start = end = date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    return delivery_boys
+    # City manager can only see their city
+    if current_user["role"] == "city_manager" and current_user.get("city"):
+        city = current_user["city"]
+    rider_query = {"role": "delivery_boy", "is_active": True}
+    if city:
+        rider_query["city"] = city
+    
+    riders_future = db.users.find(
+        rider_query,
+        {"_id": 0, "user_id": 1, "name": 1, "phone": 1, "city": 1, "kitchen_id": 1}
+    ).to_list(None)
+    stats_future = db.deliveries.aggregate([
+        {"$match": {"delivery_date": {"$gte": start, "$lte": end}, "delivery_boy_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$delivery_boy_id",
+            "total_deliveries": {"$sum": 1},
+            "completed": {"$sum": {"$cond": [{"$eq": ["$status", "delivered"]}, 1, 0]}},
+            "cancelled": {"$sum": {"$cond": [{"$in": ["$status", ["cancelled", "skipped"]]}, 1, 0]}},
+            "days": {"$addToSet": "$delivery_date"}
+        }}
+    ]).to_list(None)
+    riders, stats = await asyncio.gather(riders_future, stats_future)
+    
+    stats_by_rider = {row["_id"]: row for row in stats}
+    for rider in riders:
+        row = stats_by_rider.get(rider["user_id"], {})
+        rider["total_deliveries"] = row.get("total_deliveries", 0)
+        rider["completed"] = row.get("completed", 0)
+        rider["cancelled"] = row.get("cancelled", 0)
+        rider["pending"] = rider["total_deliveries"] - rider["completed"] - rider["cancelled"]
+        rider["active_days"] = len(row.get("days", []))
+    
+    return riders
 
 # ==================== AUDIT LOGS ====================
 
 @api_router.get("/audit-logs")
-async def get_audit_logs(entity_type: Optional[str] = None, user_id: Optional[str] = None, limit: int = 100, current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
+async def get_audit_logs(
+    response: Response,
+    entity_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    stream: bool = False,
+    current_user: dict = Depends(require_roles(["super_admin", "admin"]))
+):
     query = {}
     if entity_type:
         query["entity_type"] = entity_type
     if user_id:
         query["user_id"] = user_id
     
-    return await db.audit_logs.find(query, {"_id": 0}).sort("timestamp", -1).to_list(limit)
+    sort = [("timestamp", DESCENDING), ("log_id", DESCENDING)]
+    return await paginated_find(db.audit_logs, query, {"_id": 0}, sort, response, cursor, limit, stream)
+
+# ==================== EXPORTS ====================
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "2000"))
+
+# collection -> date field, sort, default columns and the columns that may be requested
+EXPORT_SPECS = {
+    "deliveries": {
+        "date_field": "delivery_date",
+        "sort": [("delivery_date", ASCENDING), ("delivery_id", ASCENDING)],
+        "columns": ["delivery_id", "delivery_date", "meal_period", "status", "kitchen_id", "subscription_id", "user_id",
+                    "delivery_boy_id", "diet_type", "delivery_day_number", "address", "delivered_at", "cancelled_at"],
+        "extra_columns": ["menu_items", "location", "allergy_notes", "customer_notes", "marked_ready_at", "dispatched_at",
+                          "cancelled_by", "cancellation_reason", "auto_extended", "created_at"],
+    },
+    "subscriptions": {
+        "date_field": "created_at",
+        "sort": [("created_at", ASCENDING), ("subscription_id", ASCENDING)],
+        "columns": ["subscription_id", "created_at", "user_id", "city", "kitchen_id", "plan_id", "plan_type", "diet_type",
+                    "status", "total_deliveries", "completed_deliveries", "remaining_deliveries", "amount_paid"],
+        "extra_columns": ["meal_periods", "delivery_days", "start_date", "extended_deliveries", "next_renewal_amount",
+                          "assigned_delivery_boy_id", "schedule_status", "created_by"],
+    },
+    "audit_logs": {
+        "date_field": "timestamp",
+        "sort": [("timestamp", ASCENDING), ("log_id", ASCENDING)],
+        "columns": ["log_id", "timestamp", "user_id", "user_role", "action", "entity_type", "entity_id", "ip_address"],
+        "extra_columns": ["details"],
+    },
+}
+
+def _export_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class ExportEncoder:
+    """Encodes batches of documents as CSV or gzip-compressed NDJSON; called off the event loop"""
+    
+    def __init__(self, fmt: str, columns: List[str]):
+        self.fmt = fmt
+        self.columns = columns
+        self.header_written = False
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if fmt == "ndjson" else None  # 31 = gzip container
+    
+    def encode(self, docs: List[dict]) -> bytes:
+        if self.fmt == "csv":
+            out = StringIO()
+            writer = csv.writer(out)
+            if not self.header_written:
+                writer.writerow(self.columns)
+                self.header_written = True
+            writer.writerows([_export_value(doc.get(c)) for c in self.columns] for doc in docs)
+            return out.getvalue().encode()
+        data = "".join(json.dumps({c: doc.get(c) for c in self.columns}, default=_json_default) + "\n" for doc in docs)
+        return self.compressor.compress(data.encode())
+    
+    def finish(self) -> bytes:
+        if self.fmt == "csv":
+            return b"" if self.header_written else self.encode([])
+        return self.compressor.flush()
+
+async def _export_stream(cursor, encoder: ExportEncoder):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            chunk = await run_in_threadpool(encoder.encode, batch)
+            batch = []
+            if chunk:
+                yield chunk
+    if batch:
+        yield await run_in_threadpool(encoder.encode, batch)
+    yield encoder.finish()
+
+@api_router.get("/exports/{collection}")
+async def export_collection(
+    collection: str,
+    request: Request,
+    format: str = "csv",
+    columns: Optional[str] = None,
+    city: Optional[str] = None,
+    kitchen_id: Optional[str] = None,
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: dict = Depends(require_roles(["super_admin", "admin", "city_manager"]))
+):
+    """Stream a full export as CSV or gzip NDJSON (dates are inclusive YYYY-MM-DD)"""
+    spec = EXPORT_SPECS.get(collection)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown export, expected one of: {', '.join(EXPORT_SPECS)}")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if collection == "audit_logs" and current_user["role"] == "city_manager":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else spec["columns"]
+    unknown = set(selected) - set(spec["columns"]) - set(spec["extra_columns"])
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown column(s): {', '.join(sorted(unknown))}")
+    
+    if current_user["role"] == "city_manager":
+        city = current_user.get("city")
+    query = {}
+    if start_date or end_date:
+        query[spec["date_field"]] = {}
+        if start_date:
+            query[spec["date_field"]]["$gte"] = parse_date(start_date, "start_date").strftime("%Y-%m-%d")
+        if end_date:
+            query[spec["date_field"]]["$lt"] = (parse_date(end_date, "end_date") + timedelta(days=1)).strftime("%Y-%m-%d")
+    if status:
+        query["status"] = status
+    if collection != "audit_logs":
+        if kitchen_id:
+            query["kitchen_id"] = kitchen_id
+        if city and collection == "subscriptions":
+            query["city"] = city
+        elif city:
+            # Deliveries carry no city; restrict to the city's kitchens
+            kitchen_ids = await db.kitchens.distinct("kitchen_id", {"city": city})
+            if not kitchen_id:
+                query["kitchen_id"] = {"$in": kitchen_ids}
+            elif kitchen_id not in kitchen_ids:
+                query["kitchen_id"] = {"$in": []}
+    
+    projection = {"_id": 0, **{c: 1 for c in selected}}
+    cursor = db[collection].find(query, projection).sort(spec["sort"]).batch_size(EXPORT_BATCH_SIZE)
+    await log_action(current_user["user_id"], current_user["role"], "export", collection, format, {"query": query, "columns": selected}, request)
+    
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    filename = f"{collection}-{stamp}.csv" if format == "csv" else f"{collection}-{stamp}.ndjson.gz"
+    return StreamingResponse(
+        _export_stream(cursor, ExportEncoder(format, selected)),
+        media_type="text/csv" if format == "csv" else "application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ==================== PAYMENT GATEWAY ====================
+
+PAYMENT_TIMEOUT = float(os.environ.get("PAYMENT_TIMEOUT", "10"))  # seconds per gateway call
+PAYMENT_ORDER_REUSE_SECONDS = int(os.environ.get("PAYMENT_ORDER_REUSE_SECONDS", "900"))
+
+class PaymentGatewayError(Exception):
+    pass
+
+class PaymentGateway(ABC):
+    """Async payment gateway. Signatures are verified locally with HMAC-SHA256."""
+    
+    name = "base"
+    
+    def __init__(self, key_id: str, key_secret: str):
+        self.key_id = key_id
+        self.key_secret = key_secret
+    
+    @abstractmethod
+    async def create_order(self, amount: int, currency: str, receipt: str, notes: dict) -> dict:
+        """Create an order and return the gateway's order document"""
+    
+    def sign(self, order_id: str, payment_id: str) -> str:
+        return hmac.new(self.key_secret.encode(), f"{order_id}|{payment_id}".encode(), hashlib.sha256).hexdigest()
+    
+    def verify_signature(self, order_id: Optional[str], payment_id: Optional[str], signature: Optional[str]) -> bool:
+        if not (order_id and payment_id and signature):
+            return False
+        return hmac.compare_digest(self.sign(order_id, payment_id), signature)
+    
+    async def close(self):
+        pass
+
+class RazorpayGateway(PaymentGateway):
+    """Razorpay Orders API over a pooled async HTTP client"""
+    
+    name = "razorpay"
+    
+    def __init__(self, key_id: str, key_secret: str, timeout: float, transport: Optional[httpx.AsyncBaseTransport] = None):
+        super().__init__(key_id, key_secret)
+        self._client = httpx.AsyncClient(
+            base_url="https://api.razorpay.com/v1",
+            auth=(key_id, key_secret),
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            transport=transport
+        )
+    
+    async def create_order(self, amount: int, currency: str, receipt: str, notes: dict) -> dict:
+        try:
+            response = await self._client.post("/orders", json={
+                "amount": amount,
+                "currency": currency,
+                "receipt": receipt,
+                "payment_capture": 1,
+                "notes": notes
+            })
+        except httpx.TimeoutException:
+            raise PaymentGatewayError("Payment gateway timed out")
+        except httpx.HTTPError as e:
+            raise PaymentGatewayError(f"Payment gateway unreachable: {e}")
+        if response.status_code >= 400:
+            raise PaymentGatewayError(self._error_description(response))
+        return response.json()
+    
+    @staticmethod
+    def _error_description(response: httpx.Response) -> str:
+        """Razorpay's error description; proxies and load balancers may answer with HTML or nothing"""
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        error = body.get("error") if isinstance(body, dict) else None
+        if isinstance(error, dict) and error.get("description"):
+            return error["description"]
+        return f"Payment gateway error ({response.status_code})"
+    
+    async def close(self):
+        await self._client.aclose()
+
+class StubPaymentGateway(PaymentGateway):
+    """In-process gateway for offline development and load tests - no network calls"""
+    
+    name = "stub"
+    
+    async def create_order(self, amount: int, currency: str, receipt: str, notes: dict) -> dict:
+        return {
+            "id": f"order_{uuid.uuid4().hex[:14]}",
+            "entity": "order",
+            "amount": amount,
+            "amount_paid": 0,
+            "amount_due": amount,
+            "currency": currency,
+            "receipt": receipt,
+            "status": "created",
+            "notes": notes,
+            "created_at": int(datetime.now(timezone.utc).timestamp())
+        }
+    
+    def complete_payment(self, order_id: str) -> dict:
+        """Simulate the checkout callback payload for an order"""
+        payment_id = f"pay_{uuid.uuid4().hex[:14]}"
+        return {
+            "razorpay_order_id": order_id,
+            "razorpay_payment_id": payment_id,
+            "razorpay_signature": self.sign(order_id, payment_id)
+        }
+
+payment_gateway: Optional[PaymentGateway] = None
+if PAYMENT_GATEWAY == "razorpay" and RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
+    payment_gateway = RazorpayGateway(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET, PAYMENT_TIMEOUT)
+elif PAYMENT_GATEWAY == "stub":
+    payment_gateway = StubPaymentGateway("rzp_test_stub", RAZORPAY_KEY_SECRET or "stub_secret")
+
+# Orders being created right now, keyed by idempotency key - concurrent duplicates share one call
+_inflight_orders: Dict[str, tuple] = {}  # key -> (future, (amount, subscription_id))
+
+def _idempotency_conflict():
+    return HTTPException(status_code=409, detail="Idempotency-Key was already used for a different amount or subscription")
+
+async def get_or_create_order(idempotency_key: str, amount: int, subscription_id: Optional[str], user_id: str) -> dict:
+    """Return the open order for this idempotency key, creating it at most once.
+
+    Keys are namespaced per user by the caller; reusing one with a different payload is a 409.
+    """
+    if idempotency_key in _inflight_orders:
+        inflight, payload = _inflight_orders[idempotency_key]
+        if payload != (amount, subscription_id):
+            raise _idempotency_conflict()
+        return await asyncio.shield(inflight)
+    
+    future = asyncio.get_running_loop().create_future()
+    _inflight_orders[idempotency_key] = (future, (amount, subscription_id))
+    try:
+        reuse_after = (datetime.now(timezone.utc) - timedelta(seconds=PAYMENT_ORDER_REUSE_SECONDS)).isoformat()
+        existing = await db.payment_orders.find_one(
+            {"idempotency_key": idempotency_key, "status": "created", "created_at": {"$gte": reuse_after}},
+            {"_id": 0, "gateway_order": 1, "amount": 1, "subscription_id": 1}
+        )
+        if existing and (existing.get("amount"), existing.get("subscription_id")) != (amount, subscription_id):
+            raise _idempotency_conflict()
+        if existing and existing.get("gateway_order"):
+            order = existing["gateway_order"]
+        else:
+            order = await asyncio.wait_for(
+                payment_gateway.create_order(
+                    amount, "INR", f"rcpt_{uuid.uuid4().hex[:12]}",
+                    {"subscription_id": subscription_id, "user_id": user_id}
+                ),
+                PAYMENT_TIMEOUT
+            )
+            await db.payment_orders.insert_one({
+                "order_id": order["id"],
+                "idempotency_key": idempotency_key,
+                "user_id": user_id,
+                "subscription_id": subscription_id,
+                "amount": amount,
+                "status": "created",
+                "gateway": payment_gateway.name,
+                "gateway_order": order,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+        future.set_result(order)
+        return order
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else is waiting
+        raise
+    finally:
+        del _inflight_orders[idempotency_key]
 
 # ==================== RAZORPAY PAYMENT ====================
 
 @api_router.post("/payments/create-order")
 async def create_payment_order(request: Request, current_user: dict = Depends(get_current_user)):
-    """Create Razorpay payment order"""
-    if not razorpay_client:
+    """Create Razorpay payment order (idempotent per Idempotency-Key header, or user/subscription/amount)"""
+    if not payment_gateway:
         raise HTTPException(status_code=503, detail="Payment service not configured")
     
     body = await request.json()
     amount = body.get("amount")  # In paise
     subscription_id = body.get("subscription_id")
+    if not isinstance(amount, int) or amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount (in paise) must be a positive integer")
     
-    order = razorpay_client.order.create({
-        "amount": amount,
-        "currency": "INR",
-        "payment_capture": 1,
-        "notes": {"subscription_id": subscription_id, "user_id": current_user["user_id"]}
-    })
-    
-    # Store order
-    await db.payment_orders.insert_one({
-        "order_id": order["id"],
-        "user_id": current_user["user_id"],
-        "subscription_id": subscription_id,
-        "amount": amount,
-        "status": "created",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    return order
+    client_key = request.headers.get("Idempotency-Key")
+    idempotency_key = f"{current_user['user_id']}:{client_key}" if client_key else f"{current_user['user_id']}:{subscription_id}:{amount}"
+    try:
+        return await get_or_create_order(idempotency_key, amount, subscription_id, current_user["user_id"])
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Payment gateway timed out")
+    except PaymentGatewayError as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
 @api_router.post("/payments/verify")
 async def verify_payment(request: Request):
-    """Verify Razorpay payment"""
-    if not razorpay_client:
+    """Verify Razorpay payment (signature checked locally, no gateway call)"""
+    if not payment_gateway:
         raise HTTPException(status_code=503, detail="Payment service not configured")
     
     body = await request.json()
     
-    try:
-        razorpay_client.utility.verify_payment_signature({
-            "razorpay_order_id": body.get("razorpay_order_id"),
-            "razorpay_payment_id": body.get("razorpay_payment_id"),
-            "razorpay_signature": body.get("razorpay_signature")
-        })
-        
-        # Update order status
-        await db.payment_orders.update_one(
-            {"order_id": body.get("razorpay_order_id")},
-            {"$set": {"status": "paid", "payment_id": body.get("razorpay_payment_id")}}
-        )
-        
-        return {"status": "success"}
-    except Exception as e:
+    if not payment_gateway.verify_signature(body.get("razorpay_order_id"), body.get("razorpay_payment_id"), body.get("razorpay_signature")):
         raise HTTPException(status_code=400, detail="Payment verification failed")
+    
+    # Update order status (only the first verification counts towards revenue)
+    paid_at = datetime.now(timezone.utc)
+    order = await db.payment_orders.find_one_and_update(
+        {"order_id": body.get("razorpay_order_id"), "status": {"$ne": "paid"}},
+        {"$set": {"status": "paid", "payment_id": body.get("razorpay_payment_id"), "paid_at": paid_at.isoformat()}},
+        projection={"_id": 0, "amount": 1, "subscription_id": 1}
+    )
+    if order:
+        sub = await db.subscriptions.find_one({"subscription_id": order.get("subscription_id")}, {"_id": 0, "city": 1, "kitchen_id": 1}) or {}
+        await record_revenue(paid_at, sub.get("city"), sub.get("kitchen_id"), payments_received=(order.get("amount") or 0) / 100, payment_count=1)
+    
+    return {"status": "success"}
+
+@api_router.post("/payments/stub/complete")
+async def complete_stub_payment(request: Request, current_user: dict = Depends(get_current_user)):
+    """Stub gateway only - return a signed checkout payload for an order (load testing)"""
+    if not isinstance(payment_gateway, StubPaymentGateway):
+        raise HTTPException(status_code=404, detail="Stub payment gateway not enabled")
+    body = await request.json()
+    order = await db.payment_orders.find_one({"order_id": body.get("order_id")}, {"_id": 0, "order_id": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return payment_gateway.complete_payment(order["order_id"])
 
 # ==================== IMAGE UPLOAD ====================
 
-import base64
+# Content-addressed image store: blobs live on disk under their SHA-256, db.images
+# holds the metadata and the size variants rendered at upload time
+IMAGE_STORE_DIR = Path(os.environ.get("IMAGE_STORE_DIR", ROOT_DIR / "uploads" / "images"))
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
-@api_router.post("/upload-image")
-async def upload_image(request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin", "kitchen_manager"]))):
-    """Upload image and return URL (stores as base64 data URL)"""
-    body = await request.json()
-    image_data = body.get("image_data")  # Base64 encoded image
-    
-    if not image_data:
-        raise HTTPException(status_code=400, detail="No image data provided")
-    
-    # Store as data URL (in production, use cloud storage)
-    image_id = f"img_{uuid.uuid4().hex[:12]}"
+_image_pool: Optional[ProcessPoolExecutor] = None
+
+def image_pool() -> ProcessPoolExecutor:
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+def _blob_path(sha256: str) -> Path:
+    return IMAGE_STORE_DIR / sha256[:2] / sha256[2:4] / sha256
+
+def _write_blobs(blobs: List[tuple]):
+    for sha256, data in blobs:
+        path = _blob_path(sha256)
+        if path.exists():
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{sha256}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+def decode_image_payload(image_data: str) -> bytes:
+    """Decode a base64 string or data URL"""
+    if image_data.startswith("data:"):
+        image_data = image_data.partition(",")[2]
+    try:
+        return base64.b64decode(image_data, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Image data is not valid base64")
+
+async def _materialize_image(data: bytes, kind: str) -> dict:
+    """Validate, render variants (process pool) and write all blobs; returns metadata fields"""
+    if len(data) > IMAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        rendered = await asyncio.get_running_loop().run_in_executor(image_pool(), render_variants, data, kind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    sha256 = hashlib.sha256(data).hexdigest()
+    blobs = [(sha256, data)]
+    variants = {}
+    for name, variant in rendered["variants"].items():
+        variant_sha = hashlib.sha256(variant["data"]).hexdigest()
+        blobs.append((variant_sha, variant["data"]))
+        variants[name] = {
+            "sha256": variant_sha,
+            "content_type": variant["content_type"],
+            "size": len(variant["data"]),
+            "width": variant["width"],
+            "height": variant["height"]
+        }
+    await run_in_threadpool(_write_blobs, blobs)
     
-    # Save to database
-    await db.images.insert_one({
-        "image_id": image_id,
-        "data": image_data,
+    return {
+        "sha256": sha256,
+        "kind": kind,
+        "content_type": rendered["original"]["content_type"],
+        "size": len(data),
+        "width": rendered["original"]["width"],
+        "height": rendered["original"]["height"],
+        "variants": variants
+    }
+
+async def store_image(data: bytes, kind: str, created_by: Optional[str]) -> dict:
+    """Store an image, deduplicated by content hash"""
+    existing = await db.images.find_one({"sha256": hashlib.sha256(data).hexdigest(), "kind": kind}, {"_id": 0})
+    if existing:
+        return existing
+    doc = {
+        "image_id": f"img_{uuid.uuid4().hex[:12]}",
+        **await _materialize_image(data, kind),
         "created_at": datetime.now(timezone.utc).isoformat(),
-        "created_by": current_user["user_id"]
-    })
+        "created_by": created_by
+    }
+    await db.images.insert_one(doc)
+    doc.pop("_id", None)
+    return doc
+
+def _image_response_body(image: dict) -> dict:
+    image_url = f"/api/images/{image['image_id']}"
+    return {
+        "image_url": image_url,
+        "image_id": image["image_id"],
+        "variants": {name: f"{image_url}?size={name}" for name in image.get("variants", {})}
+    }
+
+@api_router.post("/upload-image")
+async def upload_image(request: Request, kind: str = "menu", current_user: dict = Depends(require_roles(["super_admin", "admin", "kitchen_manager"]))):
+    """Upload an image (raw image/* body, or JSON {image_data: base64 or data URL}) and return its URL"""
+    if kind not in ["menu", "banner"]:
+        raise HTTPException(status_code=400, detail="Kind must be menu or banner")
     
-    # Return URL that can be used to fetch the image
-    return {"image_url": f"/api/images/{image_id}", "image_id": image_id}
+    if request.headers.get("content-type", "").startswith("image/"):
+        data = await request.body()
+    else:
+        body = await request.json()
+        image_data = body.get("image_data")  # Base64 encoded image
+        if not image_data:
+            raise HTTPException(status_code=400, detail="No image data provided")
+        kind = body.get("kind", kind)
+        data = decode_image_payload(image_data)
+    
+    image = await store_image(data, kind, current_user["user_id"])
+    return _image_response_body(image)
+
+def _parse_range(range_header: str, total: int) -> Optional[tuple]:
+    """Parse a single 'bytes=' range into inclusive (start, end); None if unsatisfiable"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = min(int(end_s), total - 1) if end_s else total - 1
+        else:
+            start = max(total - int(end_s), 0)
+            end = total - 1
+    except ValueError:
+        return None
+    if start > end or start >= total:
+        return None
+    return start, end
+
+async def _iter_file(handle, start: int, length: int):
+    try:
+        await run_in_threadpool(handle.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await run_in_threadpool(handle.read, min(IMAGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await run_in_threadpool(handle.close)
 
 @api_router.get("/images/{image_id}")
-async def get_image(image_id: str):
-    """Get image by ID"""
+async def get_image(image_id: str, request: Request, size: Optional[str] = None):
+    """Stream an image (or one of its size variants) with ETag, caching and Range support"""
     image = await db.images.find_one({"image_id": image_id}, {"_id": 0})
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    # Return base64 data
-    return {"image_data": image.get("data")}
+    if "data" in image:
+        # Legacy base64 document not yet migrated
+        header = image["data"].partition(",")[0] if image["data"].startswith("data:") else ""
+        data = decode_image_payload(image["data"])
+        content_type = header[5:].split(";")[0] or "application/octet-stream"
+        return Response(content=data, media_type=content_type, headers={"ETag": f'"{hashlib.sha256(data).hexdigest()}"'})
+    
+    blob = image
+    if size:
+        blob = image.get("variants", {}).get(size)
+        if not blob:
+            raise HTTPException(status_code=404, detail="Image size not found")
+    
+    etag = f'"{blob["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    
+    total = blob["size"]
+    start, end, status_code = 0, total - 1, 200
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) == etag:
+        byte_range = _parse_range(range_header, total)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{total}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    
+    try:
+        handle = await run_in_threadpool(open, _blob_path(blob["sha256"]), "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image data missing")
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_iter_file(handle, start, end - start + 1), status_code=status_code, media_type=blob["content_type"], headers=headers)
+
+async def migrate_legacy_images() -> dict:
+    """Convert base64 image documents and inline data-URL image_urls into stored images.
+
+    Absolute ".../api/images/<id>" URLs saved by older clients are rewritten to the
+    relative "/api/images/<id>" form that upload-image returns.
+    """
+    counts = {"images": 0, "menu_items": 0, "banners": 0, "relative_urls": 0, "failed": 0}
+    
+    async for doc in db.images.find({"data": {"$exists": True}}, {"_id": 0, "image_id": 1, "data": 1}):
+        try:
+            fields = await _materialize_image(decode_image_payload(doc["data"]), "menu")
+        except HTTPException as e:
+            counts["failed"] += 1
+            await db.images.update_one({"image_id": doc["image_id"]}, {"$set": {"migration_error": e.detail}})
+            continue
+        await db.images.update_one({"image_id": doc["image_id"]}, {"$set": fields, "$unset": {"data": "", "migration_error": ""}})
+        counts["images"] += 1
+    
+    for collection, id_field, kind in [("menu_items", "item_id", "menu"), ("banners", "banner_id", "banner")]:
+        async for doc in db[collection].find({"image_url": {"$regex": "^data:"}}, {"_id": 0, id_field: 1, "image_url": 1}):
+            try:
+                image = await store_image(decode_image_payload(doc["image_url"]), kind, None)
+            except HTTPException:
+                counts["failed"] += 1
+                continue
+            await db[collection].update_one({id_field: doc[id_field]}, {"$set": {"image_url": f"/api/images/{image['image_id']}"}})
+            if collection == "menu_items":
+                await refresh_plan_snapshots(doc[id_field])
+            counts[collection] += 1
+        
+        async for doc in db[collection].find({"image_url": {"$regex": "^https?://[^/]+/api/images/"}}, {"_id": 0, id_field: 1, "image_url": 1}):
+            relative_url = "/api/images/" + doc["image_url"].split("/api/images/", 1)[1]
+            await db[collection].update_one({id_field: doc[id_field]}, {"$set": {"image_url": relative_url}})
+            if collection == "menu_items":
+                await refresh_plan_snapshots(doc[id_field])
+            counts["relative_urls"] += 1
+    await catalog_cache.invalidate("menu_items", "banners")
+    return counts
+
+@api_router.post("/admin/migrations/images")
+async def run_image_migration(request: Request, current_user: dict = Depends(require_roles(["super_admin"]))):
+    """Move legacy base64 images into the binary image store"""
+    counts = await migrate_legacy_images()
+    await log_action(current_user["user_id"], current_user["role"], "migrate_images", "system", "images", counts, request)
+    return counts
 
 # ==================== CONSTANTS ENDPOINTS ====================
 
-@api_router.get("/constants")
-async def get_constants():
-    """Get all system constants for dropdowns"""
+def build_constants() -> dict:
+    """All system constants for dropdowns"""
     return {
         "roles": ROLES,
         "cities": CITIES,
@@ -1683,10 +4420,18 @@ async def get_constants():
         ]
     }
 
+CONSTANTS_BODY = json.dumps(build_constants(), separators=(",", ":")).encode()
+CONSTANTS_ETAG = f'W/"{hashlib.sha1(CONSTANTS_BODY).hexdigest()[:16]}"'
+
+@api_router.get("/constants")
+async def get_constants(request: Request):
+    """Get all system constants for dropdowns"""
+    return etag_response(request, CONSTANTS_BODY, CONSTANTS_ETAG)
+
 @api_router.get("/announcements")
-async def get_announcements():
+async def get_announcements(request: Request):
     """Get active announcements"""
-    return await db.announcements.find({"is_active": True}, {"_id": 0}).sort("created_at", -1).to_list(10)
+    return await cached_catalog(request, "announcements", None, lambda: db.announcements.find({"is_active": True}, {"_id": 0}).sort("created_at", -1).to_list(10))
 
 @api_router.post("/announcements")
 async def create_announcement(request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
@@ -1695,12 +4440,13 @@ async def create_announcement(request: Request, current_user: dict = Depends(req
     doc = announcement.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.announcements.insert_one(doc)
+    await catalog_cache.invalidate("announcements")
     return await db.announcements.find_one({"announcement_id": announcement.announcement_id}, {"_id": 0})
 
 @api_router.get("/shop-items")
-async def get_shop_items():
+async def get_shop_items(request: Request):
     """Get shop items for customers"""
-    return await db.shop_items.find({"is_active": True}, {"_id": 0}).to_list(100)
+    return await cached_catalog(request, "shop_items", None, lambda: db.shop_items.find({"is_active": True}, {"_id": 0}).to_list(100))
 
 @api_router.post("/shop-items")
 async def create_shop_item(request: Request, current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
@@ -1709,8 +4455,75 @@ async def create_shop_item(request: Request, current_user: dict = Depends(requir
     doc = item.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.shop_items.insert_one(doc)
+    await catalog_cache.invalidate("shop_items")
     return await db.shop_items.find_one({"item_id": item.item_id}, {"_id": 0})
 
+# ==================== ADMIN / MAINTENANCE ====================
+
+@api_router.get("/admin/metrics")
+async def get_metrics(current_user: dict = Depends(require_roles(["super_admin", "admin"]))):
+    """In-process cache and queue counters for this worker"""
+    return {
+        "worker_id": WORKER_ID,
+        "session_cache": session_cache.stats(),
+        "audit_log_queue": audit_log_writer.stats(),
+        "notification_queue": notification_writer.stats(),
+        "event_hub": event_hub.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "production_sheets": production_sheets.stats()
+    }
+
+@api_router.get("/admin/indexes")
+async def get_index_report(explain: bool = True, current_user: dict = Depends(require_roles(["super_admin"]))):
+    """Report missing/unused indexes and the query plans of hot-path queries"""
+    result = {"collections": await index_report()}
+    if explain:
+        result["hot_queries"] = await explain_hot_queries()
+    return result
+
+@api_router.post("/admin/indexes/sync")
+async def sync_indexes(request: Request, current_user: dict = Depends(require_roles(["super_admin"]))):
+    """Create any registry index that is missing"""
+    created = await ensure_indexes()
+    await log_action(current_user["user_id"], current_user["role"], "sync_indexes", "system", "indexes", created, request)
+    return {"created": created}
+
+# Collections with a {lat, lng} field and the GeoJSON sibling backing their 2dsphere index
+GEO_SOURCES = [("users", "google_location"), ("kitchens", "location"), ("deliveries", "location")]
+
+def _geo_migration_filter(source: str) -> dict:
+    return {
+        "geo": {"$exists": False},
+        f"{source}.lat": {"$type": "number", "$gte": -90, "$lte": 90},
+        f"{source}.lng": {"$type": "number", "$gte": -180, "$lte": 180},
+        "$nor": [{f"{source}.lat": 0, f"{source}.lng": 0}],
+    }
+
+async def migrate_geo_fields() -> Dict[str, int]:
+    """Derive the GeoJSON geo field from legacy {lat, lng} dicts with one pipeline update per collection"""
+    counts = {}
+    for collection, source in GEO_SOURCES:
+        result = await db[collection].update_many(
+            _geo_migration_filter(source),
+            [{"$set": {"geo": {"type": "Point", "coordinates": [f"${source}.lng", f"${source}.lat"]}}}]
+        )
+        counts[collection] = result.modified_count
+    return counts
+
+async def geo_migration_pending() -> bool:
+    for collection, source in GEO_SOURCES:
+        if await db[collection].find_one(_geo_migration_filter(source), {"_id": 1}):
+            return True
+    return False
+
+@api_router.post("/admin/migrations/geo")
+async def run_geo_migration(request: Request, current_user: dict = Depends(require_roles(["super_admin"]))):
+    """Backfill GeoJSON geo fields for users, kitchens and deliveries"""
+    counts = await migrate_geo_fields()
+    await log_action(current_user["user_id"], current_user["role"], "migrate_geo", "system", "geo", counts, request)
+    await catalog_cache.invalidate("kitchens")
+    return counts
+
 # ==================== ROOT ====================
 
 @api_router.get("/")
@@ -1727,12 +4540,46 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_tasks():
+    await ensure_indexes()
+    audit_log_writer.start()
+    notification_writer.start()
+    await rebuild_notification_counters()
+    if not await db.revenue_daily.find_one({}):
+        await backfill_subscription_cities()
+        await rebuild_revenue_rollup()
+    app.state.delivery_generation_task = asyncio.create_task(delivery_generation_worker())
+    if SESSION_CACHE_SYNC != "none":
+        app.state.session_sync_task = asyncio.create_task(session_invalidation_listener())
+    if CATALOG_CACHE_SYNC_INTERVAL > 0:
+        await catalog_cache.sync()
+        app.state.catalog_sync_task = asyncio.create_task(catalog_sync_loop())
+    if await db.deliveries.find_one({"diet_type": {"$exists": False}}, {"_id": 1}):
+        await backfill_delivery_diet_types()
+    if await geo_migration_pending():
+        await migrate_geo_fields()
+    await requeue_pending_schedules()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.delivery_generation_task.cancel()
+    if SESSION_CACHE_SYNC != "none":
+        app.state.session_sync_task.cancel()
+    if CATALOG_CACHE_SYNC_INTERVAL > 0:
+        app.state.catalog_sync_task.cancel()
+    await notification_writer.stop()
+    await audit_log_writer.stop()
+    password_hasher.shutdown()
+    if payment_gateway:
+        await payment_gateway.close()
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False)
     client.close()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Test Suite for the delivery status state machine
+Tests allowed/illegal transitions, ?status= support and idempotent double-taps
+"""
+
+import pytest
+import requests
+import os
+import uuid
+from datetime import date
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://foodfleet-admin.preview.emergentagent.com')
+
+# Test credentials
+SUPER_ADMIN_PHONE = "9000000001"
+SUPER_ADMIN_PASSWORD = "admin123"
+
+
+@pytest.fixture(scope="module")
+def authenticated_session():
+    """Login as super admin and return authenticated session"""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    login_response = session.post(
+        f"{BASE_URL}/api/auth/login",
+        json={"phone": SUPER_ADMIN_PHONE, "password": SUPER_ADMIN_PASSWORD}
+    )
+    assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+    return session
+
+
+@pytest.fixture
+def delivery_id(authenticated_session):
+    """A fresh scheduled delivery"""
+    response = authenticated_session.post(f"{BASE_URL}/api/deliveries", json={
+        "subscription_id": "TEST_sub_status",
+        "user_id": "TEST_user_status",
+        "kitchen_id": "TEST_kitchen_status",
+        "delivery_date": "2030-01-01",
+        "meal_period": "lunch"
+    })
+    assert response.status_code == 200, f"Create delivery failed: {response.text}"
+    assert response.json()["status"] == "scheduled"
+    return response.json()["delivery_id"]
+
+
+class TestDeliveryStatusTransitions:
+    """Test PUT /deliveries/{delivery_id}/status"""
+
+    def test_illegal_transition_rejected(self, authenticated_session, delivery_id):
+        response = authenticated_session.put(f"{BASE_URL}/api/deliveries/{delivery_id}/status", json={"status": "delivered"})
+        assert response.status_code == 400
+        print(f"✅ scheduled -> delivered rejected: {response.json()['detail']}")
+
+    def test_unknown_status_rejected(self, authenticated_session, delivery_id):
+        response = authenticated_session.put(f"{BASE_URL}/api/deliveries/{delivery_id}/status", json={"status": "teleported"})
+        assert response.status_code == 400
+
+    def test_kitchen_flow_and_double_tap(self, authenticated_session, delivery_id):
+        url = f"{BASE_URL}/api/deliveries/{delivery_id}/status"
+        first = authenticated_session.put(url, json={"status": "preparing"})
+        assert first.status_code == 200
+        assert first.json()["status"] == "preparing"
+
+        # Repeating the same change is a no-op, not an error
+        again = authenticated_session.put(url, json={"status": "preparing"})
+        assert again.status_code == 200
+        assert again.json()["status"] == "preparing"
+
+        ready = authenticated_session.put(url, json={"status": "ready"})
+        assert ready.status_code == 200
+        assert ready.json()["marked_ready_at"]
+
+    def test_status_query_parameter(self, authenticated_session, delivery_id):
+        url = f"{BASE_URL}/api/deliveries/{delivery_id}/status"
+        assert authenticated_session.put(f"{url}?status=ready").status_code == 200
+        response = authenticated_session.put(f"{url}?status=in_transit")
+        assert response.status_code == 200
+        assert response.json()["status"] == "in_transit"
+
+    def test_missing_delivery(self, authenticated_session):
+        response = authenticated_session.put(f"{BASE_URL}/api/deliveries/del_missing/status", json={"status": "ready"})
+        assert response.status_code == 404
+
+
+class TestBatchDeliveryStatus:
+    """Test POST /deliveries/status:batch"""
+
+    def test_partial_results(self, authenticated_session, delivery_id):
+        response = authenticated_session.post(f"{BASE_URL}/api/deliveries/status:batch", json={
+            "status": "ready",
+            "delivery_ids": [delivery_id, "del_missing"]
+        })
+        assert response.status_code == 200
+        results = {r["delivery_id"]: r["result"] for r in response.json()["results"]}
+        assert results == {delivery_id: "updated", "del_missing": "not_found"}
+
+        # Repeating the batch is a no-op for deliveries already in that status
+        again = authenticated_session.post(f"{BASE_URL}/api/deliveries/status:batch", json={
+            "status": "ready", "delivery_ids": [delivery_id]
+        })
+        assert again.json()["results"][0]["result"] == "unchanged"
+
+    def test_requires_ids_or_filter(self, authenticated_session):
+        response = authenticated_session.post(f"{BASE_URL}/api/deliveries/status:batch", json={"status": "ready"})
+        assert response.status_code == 400
+
+
+@pytest.fixture
+def subscription(authenticated_session):
+    """A fresh 3-day lunch subscription (Mon/Wed/Sat from Monday 2030-01-07) and its deliveries"""
+    plans = authenticated_session.get(f"{BASE_URL}/api/plans").json()
+    kitchens = authenticated_session.get(f"{BASE_URL}/api/kitchens").json()
+    if not plans or not kitchens:
+        pytest.skip("Needs at least one plan and one kitchen")
+    customer = authenticated_session.post(f"{BASE_URL}/api/users", json={
+        "phone": f"7{uuid.uuid4().int % 10**9:09d}",
+        "name": "TEST Extension Customer",
+        "role": "customer"
+    })
+    assert customer.status_code == 200, customer.text
+    user_id = customer.json()["user_id"]
+    response = authenticated_session.post(f"{BASE_URL}/api/subscriptions", json={
+        "user_id": user_id,
+        "plan_id": plans[0]["plan_id"],
+        "kitchen_id": kitchens[0]["kitchen_id"],
+        "start_date": "2030-01-07",
+        "meal_periods": ["lunch"],
+        "delivery_days": ["monday", "wednesday", "saturday"],
+        "total_deliveries": 3,
+        "remaining_deliveries": 3,
+        "defer_deliveries": False
+    })
+    assert response.status_code == 200, response.text
+    deliveries = authenticated_session.get(f"{BASE_URL}/api/deliveries", params={"user_id": user_id}).json()
+    assert [d["delivery_date"] for d in sorted(deliveries, key=lambda d: d["delivery_date"])] == ["2030-01-07", "2030-01-09", "2030-01-12"]
+    return response.json(), user_id
+
+
+class TestCancellationExtension:
+    """Test PUT /deliveries/{delivery_id}/cancel creating the replacement delivery"""
+
+    def test_cancel_creates_one_replacement(self, authenticated_session, subscription):
+        sub, user_id = subscription
+        deliveries = sorted(
+            authenticated_session.get(f"{BASE_URL}/api/deliveries", params={"user_id": user_id}).json(),
+            key=lambda d: d["delivery_date"]
+        )
+        response = authenticated_session.put(f"{BASE_URL}/api/deliveries/{deliveries[0]['delivery_id']}/cancel", json={"reason": "TEST"})
+        assert response.status_code == 200, response.text
+        replacement_ids = response.json()["replacement_delivery_ids"]
+        assert len(replacement_ids) == 1
+
+        after = authenticated_session.get(f"{BASE_URL}/api/deliveries", params={"user_id": user_id}).json()
+        assert len(after) == len(deliveries) + 1
+        replacement = next(d for d in after if d["delivery_id"] == replacement_ids[0])
+        assert replacement["delivery_date"] > deliveries[-1]["delivery_date"]
+        weekday = date.fromisoformat(replacement["delivery_date"]).strftime("%A").lower()
+        assert weekday in ("monday", "wednesday", "saturday")
+        assert replacement["delivery_date"] == "2030-01-14"
+        assert replacement["delivery_day_number"] == deliveries[-1]["delivery_day_number"] + 1
+        assert replacement["status"] == "scheduled"
+
+    def test_second_cancel_rejected_without_extension(self, authenticated_session, subscription):
+        sub, user_id = subscription
+        delivery = authenticated_session.get(f"{BASE_URL}/api/deliveries", params={"user_id": user_id}).json()[0]
+        url = f"{BASE_URL}/api/deliveries/{delivery['delivery_id']}/cancel"
+        assert authenticated_session.put(url, json={"reason": "TEST"}).status_code == 200
+        extended = authenticated_session.get(f"{BASE_URL}/api/subscriptions/{sub['subscription_id']}").json()
+
+        again = authenticated_session.put(url, json={"reason": "TEST"})
+        assert again.status_code == 400
+        current = authenticated_session.get(f"{BASE_URL}/api/subscriptions/{sub['subscription_id']}").json()
+        assert current["total_deliveries"] == extended["total_deliveries"] == sub["total_deliveries"] + 1
+        assert current["extended_deliveries"] == extended["extended_deliveries"] == 1
+        assert len(authenticated_session.get(f"{BASE_URL}/api/deliveries", params={"user_id": user_id}).json()) == 4
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test Suite for the MongoDB index registry
+Verifies that hot-path queries are index-backed (explain plans contain no COLLSCAN)
+"""
+
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://foodfleet-admin.preview.emergentagent.com')
+
+# Test credentials
+SUPER_ADMIN_PHONE = "9000000001"
+SUPER_ADMIN_PASSWORD = "admin123"
+
+
+@pytest.fixture(scope="module")
+def authenticated_session():
+    """Login as super admin and return authenticated session"""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    login_response = session.post(
+        f"{BASE_URL}/api/auth/login",
+        json={"phone": SUPER_ADMIN_PHONE, "password": SUPER_ADMIN_PASSWORD}
+    )
+    assert login_response.status_code == 200, f"Login failed: {login_response.text}"
+    return session
+
+
+@pytest.fixture(scope="module")
+def index_report(authenticated_session):
+    """Sync the registry and fetch the index report with explain plans"""
+    sync = authenticated_session.post(f"{BASE_URL}/api/admin/indexes/sync")
+    assert sync.status_code == 200, f"Index sync failed: {sync.text}"
+    response = authenticated_session.get(f"{BASE_URL}/api/admin/indexes")
+    assert response.status_code == 200, f"Index report failed: {response.text}"
+    return response.json()
+
+
+class TestIndexRegistry:
+    """Test index reconciliation and reporting"""
+
+    def test_no_missing_indexes(self, index_report):
+        """Every registry index exists after sync"""
+        missing = {c: r["missing"] for c, r in index_report["collections"].items() if r["missing"]}
+        assert not missing, f"Missing indexes: {missing}"
+        print(f"✅ All registry indexes present across {len(index_report['collections'])} collections")
+
+    def test_session_ttl_index_registered(self, index_report):
+        """user_sessions is covered by the registry (TTL on expires_at)"""
+        assert "user_sessions" in index_report["collections"]
+        assert index_report["collections"]["user_sessions"]["missing"] == []
+
+    def test_index_report_requires_super_admin(self):
+        """Anonymous callers cannot read the index report"""
+        response = requests.get(f"{BASE_URL}/api/admin/indexes")
+        assert response.status_code == 401
+
+
+class TestHotQueryPlans:
+    """Explain-plan assertions for hot-path queries"""
+
+    def test_hot_queries_use_indexes(self, index_report):
+        """No hot query falls back to a collection scan"""
+        scans = [q for q in index_report["hot_queries"] if not q["uses_index"]]
+        assert not scans, f"Collection scans: {scans}"
+        print(f"✅ {len(index_report['hot_queries'])} hot queries are index-backed")
+
+    @pytest.mark.parametrize("collection,fields", [
+        ("deliveries", {"kitchen_id", "delivery_date"}),
+        ("deliveries", {"delivery_boy_id", "delivery_date"}),
+        ("user_sessions", {"session_token"}),
+        ("subscriptions", {"status", "remaining_deliveries"}),
+    ])
+    def test_specific_query_plan(self, index_report, collection, fields):
+        """Specific endpoint filters resolve to an IXSCAN"""
+        matches = [q for q in index_report["hot_queries"]
+                   if q["collection"] == collection and fields <= set(q["filter"])]
+        assert matches, f"No hot query registered for {collection} {fields}"
+        for q in matches:
+            assert "IXSCAN" in q["stages"], f"{collection} {q['filter']} plan: {q['stages']}"
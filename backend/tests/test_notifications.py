@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test Suite for Notifications
+Tests unread counters, cursor pagination and per-user read state of role broadcasts
+"""
+
+import pytest
+import requests
+import os
+import time
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://foodfleet-admin.preview.emergentagent.com')
+
+# Test credentials
+SUPER_ADMIN_PHONE = "9000000001"
+ADMIN_PHONE = "9000000002"
+PASSWORD = "admin123"
+
+
+def login(phone):
+    session = requests.Session()
+    response = session.post(f"{BASE_URL}/api/auth/login", json={"phone": phone, "password": PASSWORD})
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return session
+
+
+@pytest.fixture(scope="module")
+def admin_session():
+    return login(ADMIN_PHONE)
+
+
+class TestUnreadCount:
+    """Test GET /notifications/unread-count"""
+
+    def test_unread_count_shape(self, admin_session):
+        response = admin_session.get(f"{BASE_URL}/api/notifications/unread-count")
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data["unread"], int)
+        assert data["unread"] >= 0
+        print(f"✅ Unread notifications: {data['unread']}")
+
+    def test_unread_count_requires_auth(self):
+        response = requests.get(f"{BASE_URL}/api/notifications/unread-count")
+        assert response.status_code == 401
+
+    def test_unread_count_matches_list_after_read_all(self, admin_session):
+        response = admin_session.put(f"{BASE_URL}/api/notifications/read-all")
+        assert response.status_code == 200
+        assert admin_session.get(f"{BASE_URL}/api/notifications/unread-count").json()["unread"] == 0
+        notifications = admin_session.get(f"{BASE_URL}/api/notifications").json()
+        assert all(n["is_read"] for n in notifications)
+
+
+class TestNotificationPagination:
+    """Test keyset cursor pagination"""
+
+    def test_cursor_pages_do_not_overlap(self, admin_session):
+        first = admin_session.get(f"{BASE_URL}/api/notifications", params={"limit": 2})
+        assert first.status_code == 200
+        assert len(first.json()) <= 2
+        cursor = first.headers.get("X-Next-Cursor")
+        if not cursor:
+            pytest.skip("Not enough notifications for a second page")
+        second = admin_session.get(f"{BASE_URL}/api/notifications", params={"limit": 2, "cursor": cursor})
+        assert second.status_code == 200
+        first_ids = {n["notification_id"] for n in first.json()}
+        assert not first_ids & {n["notification_id"] for n in second.json()}
+
+    def test_invalid_cursor_rejected(self, admin_session):
+        response = admin_session.get(f"{BASE_URL}/api/notifications", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
+
+class TestBroadcastReadState:
+    """Reading role broadcasts must not change other users' state"""
+
+    def test_read_all_is_per_user(self, admin_session):
+        super_admin = login(SUPER_ADMIN_PHONE)
+        super_admin.put(f"{BASE_URL}/api/notifications/read-all")
+
+        # A new subscription broadcasts to super_admin and admin
+        plans = super_admin.get(f"{BASE_URL}/api/plans").json()
+        kitchens = super_admin.get(f"{BASE_URL}/api/kitchens").json()
+        if not plans or not kitchens:
+            pytest.skip("Needs at least one plan and one kitchen")
+        customer = super_admin.post(f"{BASE_URL}/api/users", json={
+            "phone": f"8{uuid.uuid4().int % 10**9:09d}",
+            "name": "TEST Broadcast Customer",
+            "role": "customer"
+        })
+        assert customer.status_code == 200, customer.text
+        subscription = super_admin.post(f"{BASE_URL}/api/subscriptions", json={
+            "user_id": customer.json()["user_id"],
+            "plan_id": plans[0]["plan_id"],
+            "kitchen_id": kitchens[0]["kitchen_id"],
+            "start_date": "2030-01-07"
+        })
+        assert subscription.status_code == 200, subscription.text
+        time.sleep(1)  # notifications are written behind
+
+        before = super_admin.get(f"{BASE_URL}/api/notifications/unread-count").json()["unread"]
+        assert before >= 1
+        admin_session.put(f"{BASE_URL}/api/notifications/read-all")
+        after = super_admin.get(f"{BASE_URL}/api/notifications/unread-count").json()["unread"]
+        assert after == before
+
+        broadcast = next(
+            n for n in super_admin.get(f"{BASE_URL}/api/notifications").json()
+            if n.get("reference_id") == subscription.json()["subscription_id"]
+        )
+        assert not broadcast["is_read"]
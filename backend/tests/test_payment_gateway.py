@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test Suite for the Razorpay gateway client
+Runs against httpx.MockTransport - no network calls and no running server
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import PaymentGateway, PaymentGatewayError, RazorpayGateway  # noqa: E402
+
+
+def create_order(handler):
+    gateway = RazorpayGateway("rzp_test_key", "secret", timeout=5, transport=httpx.MockTransport(handler))
+
+    async def run():
+        try:
+            return await gateway.create_order(50000, "INR", "rcpt_1", {})
+        finally:
+            await gateway.close()
+    return asyncio.run(run())
+
+
+class TestRazorpayGateway:
+    """Test RazorpayGateway.create_order error handling"""
+
+    def test_order_created(self):
+        order = create_order(lambda request: httpx.Response(200, json={"id": "order_1", "amount": 50000}))
+        assert order["id"] == "order_1"
+
+    def test_razorpay_error_description(self):
+        body = {"error": {"code": "BAD_REQUEST_ERROR", "description": "amount exceeds maximum"}}
+        with pytest.raises(PaymentGatewayError, match="amount exceeds maximum"):
+            create_order(lambda request: httpx.Response(400, json=body))
+
+    def test_non_json_error_body(self):
+        html = "<html><body>502 Bad Gateway</body></html>"
+        with pytest.raises(PaymentGatewayError, match=r"Payment gateway error \(502\)"):
+            create_order(lambda request: httpx.Response(502, text=html))
+
+    def test_empty_and_non_dict_error_bodies(self):
+        with pytest.raises(PaymentGatewayError, match=r"\(503\)"):
+            create_order(lambda request: httpx.Response(503))
+        with pytest.raises(PaymentGatewayError, match=r"\(500\)"):
+            create_order(lambda request: httpx.Response(500, json=["unexpected"]))
+
+
+class TestPaymentGatewayBase:
+    def test_gateway_must_implement_create_order(self):
+        class IncompleteGateway(PaymentGateway):
+            pass
+
+        with pytest.raises(TypeError):
+            IncompleteGateway("key", "secret")
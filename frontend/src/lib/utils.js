@@ -4,3 +4,10 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Stored image URLs are relative to the backend ("/api/images/<id>"); the frontend
+// may be served from another origin, so resolve them against REACT_APP_BACKEND_URL.
+export function resolveImageUrl(url) {
+  if (!url || /^(https?:|data:|blob:)/.test(url)) return url;
+  return `${process.env.REACT_APP_BACKEND_URL || ""}${url}`;
+}
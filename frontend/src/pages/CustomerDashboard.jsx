@@ -15,6 +15,7 @@ import {
   CheckCircle2, CreditCard, ShoppingBag, ChevronLeft, Info, ExternalLink
 } from "lucide-react";
 import { format, parseISO, isToday, isTomorrow, isBefore, startOfDay, addDays } from "date-fns";
+import { resolveImageUrl } from "../lib/utils";
 
 const API = process.env.REACT_APP_BACKEND_URL + "/api";
 const RAZORPAY_LINK = "https://razorpay.me/@saladcaffe";
@@ -337,7 +338,7 @@ export default function CustomerDashboard({ user }) {
                   key={banner.banner_id}
                   className={`absolute inset-0 transition-opacity duration-500 ${index === currentBannerIndex ? "opacity-100" : "opacity-0"}`}
                 >
-                  <img src={banner.image_url} alt={banner.title} className="w-full h-full object-cover" />
+                  <img src={resolveImageUrl(banner.image_url)} alt={banner.title} className="w-full h-full object-cover" />
                   <div className="absolute inset-0 bg-gradient-to-t from-black/60 to-transparent" />
                   <div className="absolute bottom-4 left-4 text-white">
                     <h3 className="font-bold text-xl">{banner.title}</h3>
@@ -538,7 +539,7 @@ export default function CustomerDashboard({ user }) {
                                   <div className="flex items-center gap-3">
                                     <div className="w-12 h-12 bg-muted rounded-lg overflow-hidden">
                                       {item.image_url ? (
-                                        <img src={item.image_url} alt={item.name} className="w-full h-full object-cover" />
+                                        <img src={resolveImageUrl(item.image_url)} alt={item.name} className="w-full h-full object-cover" />
                                       ) : (
                                         <div className="w-full h-full flex items-center justify-center"><Utensils className="w-5 h-5 text-muted-foreground" /></div>
                                       )}
@@ -658,7 +659,7 @@ export default function CustomerDashboard({ user }) {
                         <div key={item.item_id} className="p-3 border rounded-lg hover:shadow-md transition-shadow cursor-pointer">
                           <div className="aspect-square bg-muted rounded-lg mb-2 overflow-hidden">
                             {item.image_url ? (
-                              <img src={item.image_url} alt={item.name} className="w-full h-full object-cover" />
+                              <img src={resolveImageUrl(item.image_url)} alt={item.name} className="w-full h-full object-cover" />
                             ) : (
                               <div className="w-full h-full flex items-center justify-center"><ShoppingBag className="w-8 h-8 text-muted-foreground" /></div>
                             )}
@@ -753,7 +754,7 @@ export default function CustomerDashboard({ user }) {
               {/* Image */}
               <div className="aspect-square w-full bg-muted rounded-lg overflow-hidden">
                 {itemDetailDialog.item.image_url ? (
-                  <img src={itemDetailDialog.item.image_url} alt={itemDetailDialog.item.name} className="w-full h-full object-cover" />
+                  <img src={resolveImageUrl(itemDetailDialog.item.image_url)} alt={itemDetailDialog.item.name} className="w-full h-full object-cover" />
                 ) : (
                   <div className="w-full h-full flex items-center justify-center"><Utensils className="w-16 h-16 text-muted-foreground" /></div>
                 )}
@@ -16,6 +16,7 @@ import {
   Plus, Settings, TrendingUp, FileText, Image, Edit, Trash2, X, Upload
 } from "lucide-react";
 import { format } from "date-fns";
+import { resolveImageUrl } from "../lib/utils";
 
 const API = process.env.REACT_APP_BACKEND_URL + "/api";
 
@@ -308,7 +309,7 @@ export default function SuperAdminDashboard({ user }) {
 
           if (res.ok) {
             const { image_url } = await res.json();
-            setNewMenuItem({ ...newMenuItem, image_url: imageData });
+            setNewMenuItem({ ...newMenuItem, image_url });
             toast.success("Image uploaded!");
           }
         } catch (err) {
@@ -488,7 +489,7 @@ export default function SuperAdminDashboard({ user }) {
                         {/* Image */}
                         <div className="w-full aspect-square bg-muted rounded-lg mb-3 overflow-hidden">
                           {item.image_url ? (
-                            <img src={item.image_url} alt={item.name} className="w-full h-full object-cover" />
+                            <img src={resolveImageUrl(item.image_url)} alt={item.name} className="w-full h-full object-cover" />
                           ) : (
                             <div className="w-full h-full flex items-center justify-center">
                               <Utensils className="w-12 h-12 text-muted-foreground" />
@@ -667,7 +668,7 @@ export default function SuperAdminDashboard({ user }) {
               <div className="flex items-center gap-4">
                 <div className="w-32 h-32 bg-muted rounded-lg overflow-hidden flex items-center justify-center border-2 border-dashed" data-testid="menu-item-image-preview">
                   {newMenuItem.image_url ? (
-                    <img src={newMenuItem.image_url} alt="Preview" className="w-full h-full object-cover" />
+                    <img src={resolveImageUrl(newMenuItem.image_url)} alt="Preview" className="w-full h-full object-cover" />
                   ) : (
                     <Upload className="w-8 h-8 text-muted-foreground" />
                   )}
@@ -960,7 +961,7 @@ export default function SuperAdminDashboard({ user }) {
                         <div className="flex items-center gap-3">
                           <div className="w-10 h-10 rounded bg-muted overflow-hidden">
                             {item.image_url ? (
-                              <img src={item.image_url} alt={item.name} className="w-full h-full object-cover" />
+                              <img src={resolveImageUrl(item.image_url)} alt={item.name} className="w-full h-full object-cover" />
                             ) : (
                               <div className="w-full h-full flex items-center justify-center">
                                 <Utensils className="w-4 h-4 text-muted-foreground" />
@@ -1063,7 +1064,7 @@ function PlanMenuBuilder({ plan, menuItems, onSave, onCancel }) {
               )}
               <div className="w-full aspect-square bg-muted rounded-md mb-2 overflow-hidden">
                 {item.image_url ? (
-                  <img src={item.image_url} alt={item.name} className="w-full h-full object-cover" />
+                  <img src={resolveImageUrl(item.image_url)} alt={item.name} className="w-full h-full object-cover" />
                 ) : (
                   <div className="w-full h-full flex items-center justify-center">
                     <Utensils className="w-6 h-6 text-muted-foreground" />